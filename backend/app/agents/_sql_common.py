@@ -0,0 +1,470 @@
+"""
+Shared plumbing for the DuckDB-backed SQL agents in csv_agents and
+csv_agents_new: the Claude client, executor and answer caches, memoized
+toolkit tools and content-addressed table snapshots.
+"""
+
+import contextvars
+import functools
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pyarrow.csv as pacsv
+from langchain_community.agent_toolkits.sql.base import create_sql_agent
+from langchain_community.agent_toolkits.sql.prompt import SQL_FUNCTIONS_SUFFIX
+from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+from langchain_community.utilities import SQLDatabase
+from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import AIMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+from langchain_core.tools import BaseTool
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from app.config.settings import settings
+from app.utils.logging_config import get_logger
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+logger = get_logger('agents')
+
+# Using Claude Haiku for reliable analytical and mathematical reasoning
+AGENT_MODEL = "claude-3-haiku-20240307"
+
+# Compiled executors keyed by a digest of the uploaded bytes (and the agent's
+# prompt), so re-uploads of the same CSV skip the DuckDB load and agent
+# construction entirely.
+EXECUTOR_CACHE_SIZE = 8
+_EXECUTOR_CACHE = OrderedDict()
+_EXECUTOR_CACHE_LOCK = threading.Lock()
+
+# Answers remembered per dataset and replayed only for the same normalized
+# question; embedding-similar questions (when sentence-transformers is
+# installed) re-run the agent seeded with the earlier question's SQL.
+ANSWER_CACHE_SIZE = 64
+SEMANTIC_MATCH_THRESHOLD = 0.92
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Wall-clock cap on a single agent run, in seconds
+AGENT_MAX_EXECUTION_TIME = 30
+
+# Output LangChain substitutes when a run hits its iteration or time limit
+AGENT_STOPPED_PREFIX = "Agent stopped due to"
+
+# Parsed tables are snapshotted to content-addressed DuckDB files so a repeat
+# upload in any session or worker copies the table in instead of re-parsing.
+# They hold users' data, so they live in an app-private directory (0700) next
+# to the file cache rather than in the shared temp dir.
+DUCKDB_SNAPSHOT_DIR = os.path.abspath(os.path.join("cache", "duckdb_snapshots"))
+DUCKDB_SNAPSHOT_MAX_BYTES = 2 * 1024 ** 3
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm(max_tokens, max_retries, request_timeout):
+    """Shared Claude client per configuration, so its HTTP keep-alive pool is reused across uploads."""
+    return ChatAnthropic(
+        model=AGENT_MODEL,
+        temperature=0.1,  # Slight randomness for creativity in analysis approaches
+        max_tokens=max_tokens,
+        api_key=settings.ANTHROPIC_API_KEY,
+        max_retries=max_retries,
+        default_request_timeout=request_timeout,
+        anthropic_api_url=None,  # Use default
+        # Opt in to prompt caching so cache_control blocks are honoured
+        default_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+    )
+
+
+# Tool observations of the agent run in progress on this thread/task, keyed by
+# (tool name, args, kwargs); set per run by CachedAgent.invoke
+_RUN_TOOL_MEMO = contextvars.ContextVar("sql_agent_tool_memo", default=None)
+
+
+@functools.lru_cache(maxsize=None)
+def _agent_prompt(prefix):
+    """create_sql_agent's tool-calling prompt with the static prefix marked for prompt caching."""
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=[
+            {
+                "type": "text",
+                "text": prefix,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ]),
+        HumanMessagePromptTemplate.from_template("{input}"),
+        AIMessage(content=SQL_FUNCTIONS_SUFFIX),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
+
+
+class CachedSchemaSQLDatabase(SQLDatabase):
+    """SQLDatabase that renders table schema and sample rows once instead of per tool call."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._table_info_cache = {}
+
+    def get_table_info(self, table_names=None):
+        key = tuple(sorted(table_names)) if table_names else None
+        if key not in self._table_info_cache:
+            self._table_info_cache[key] = super().get_table_info(table_names)
+        return self._table_info_cache[key]
+
+
+@functools.lru_cache(maxsize=1)
+def get_embedder():
+    """Local sentence embedder for question matching, or None if unavailable."""
+    if not SENTENCE_TRANSFORMERS_AVAILABLE:
+        return None
+    try:
+        return SentenceTransformer(EMBEDDING_MODEL)
+    except Exception as e:
+        logger.warning("Question embedder unavailable, using exact matching: %s", e)
+        return None
+
+
+def normalize_question(question):
+    """Lowercase and collapse punctuation/whitespace so trivial rewordings share a key."""
+    return " ".join(re.findall(r"\w+", question.lower()))
+
+
+class CachedAgent:
+    """Wraps an agent executor and reuses work for repeated questions on its dataset.
+
+    The wrapped executor is bound to one immutable CSV, so an answer stays valid
+    for as long as the executor itself is cached. Only a question that normalizes
+    to the same text gets the stored answer back; a semantically close one is
+    re-run with the SQL behind the earlier answer as a starting point, since
+    "top 5" and "top 10" embed almost identically but need different results.
+    """
+
+    def __init__(self, agent_executor):
+        self.agent_executor = agent_executor
+        self._answers = OrderedDict()  # normalized question -> (embedding, result, queries)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # copy/pickle probe dunders before __init__ has run; delegating those
+        # would recurse through the missing agent_executor attribute
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.agent_executor, name)
+
+    def _lookup(self, normalized, embedding):
+        """Return (exact result, None) or (None, queries of the closest similar question)."""
+        with self._lock:
+            entry = self._answers.get(normalized)
+            if entry is not None:
+                return entry[1], None
+            if embedding is None:
+                return None, None
+            best_score, queries = SEMANTIC_MATCH_THRESHOLD, None
+            for cached_embedding, _, cached_queries in self._answers.values():
+                if cached_embedding is None or not cached_queries:
+                    continue
+                score = float(embedding @ cached_embedding)
+                if score >= best_score:
+                    best_score, queries = score, cached_queries
+            return None, queries
+
+    def _store(self, normalized, embedding, result, queries):
+        with self._lock:
+            self._answers[normalized] = (embedding, result, queries)
+            self._answers.move_to_end(normalized)
+            while len(self._answers) > ANSWER_CACHE_SIZE:
+                self._answers.popitem(last=False)
+
+    @staticmethod
+    def _executed_queries(memo):
+        """SQL statements from one run's tool memo that returned rows rather than an error."""
+        queries = []
+        for (tool_name, args, kwargs), observation in memo.items():
+            if tool_name != "sql_db_query" or str(observation).startswith("Error"):
+                continue
+            query = args[0] if args else dict(kwargs).get("query")
+            if query:
+                queries.append(query)
+        return tuple(queries)
+
+    @staticmethod
+    def _is_final_answer(result):
+        output = result.get("output") if isinstance(result, dict) else None
+        return (
+            isinstance(output, str)
+            and output.strip() != ""
+            and not output.startswith(AGENT_STOPPED_PREFIX)
+        )
+
+    def invoke(self, inputs, *args, **kwargs):
+        question = inputs.get("input", "") if isinstance(inputs, dict) else str(inputs)
+        normalized = normalize_question(question)
+        embedder = get_embedder()
+        embedding = embedder.encode(question, normalize_embeddings=True) if embedder else None
+
+        cached, similar_queries = self._lookup(normalized, embedding)
+        if cached is not None:
+            logger.debug("Answer cache hit for question: %s", question)
+            return {**cached, "input": question}
+
+        run_inputs = inputs
+        if similar_queries:
+            logger.debug("Seeding agent with SQL from a similar question: %s", question)
+            hint = "\n".join(similar_queries)
+            run_inputs = {
+                **(inputs if isinstance(inputs, dict) else {}),
+                "input": (
+                    f"{question}\n\nA similar earlier question was answered with this SQL. "
+                    f"Adapt it to this question before running it:\n{hint}"
+                ),
+            }
+
+        # Fresh memo per run: the executor, and so its tools, is shared by every
+        # session on this CSV and may be running for several of them at once
+        memo = {}
+        token = _RUN_TOOL_MEMO.set(memo)
+        try:
+            result = self.agent_executor.invoke(run_inputs, *args, **kwargs)
+        finally:
+            _RUN_TOOL_MEMO.reset(token)
+        if similar_queries and isinstance(result, dict):
+            result = {**result, "input": question}
+        if self._is_final_answer(result):
+            self._store(normalized, embedding, result, self._executed_queries(memo))
+        return result
+
+
+class MemoizedTool(BaseTool):
+    """Delegates to a wrapped tool, replaying its observation for identical repeat calls."""
+
+    tool: BaseTool
+
+    def _run(self, *args, run_manager=None, **kwargs):
+        memo = _RUN_TOOL_MEMO.get()
+        if memo is None:
+            # Called outside CachedAgent.invoke; nothing to share with
+            return self.tool._run(*args, run_manager=run_manager, **kwargs)
+        key = (self.name, args, tuple(sorted(kwargs.items())))
+        if key in memo:
+            logger.debug("Reusing %s observation for repeated input", self.name)
+            return memo[key]
+        result = self.tool._run(*args, run_manager=run_manager, **kwargs)
+        memo[key] = result
+        return result
+
+
+class MemoizedSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """SQLDatabaseToolkit whose tools skip duplicate calls within one agent run."""
+
+    def get_tools(self):
+        return [
+            MemoizedTool(
+                name=tool.name,
+                description=tool.description,
+                args_schema=tool.args_schema,
+                tool=tool,
+            )
+            for tool in super().get_tools()
+        ]
+
+
+def _snapshot_path(digest):
+    """Content-addressed DuckDB file holding the parsed table for an upload."""
+    return os.path.join(DUCKDB_SNAPSHOT_DIR, f"csvagent-{digest.hex()}.duckdb")
+
+
+def _sql_string(value):
+    """Quote a value as a DuckDB string literal."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _load_snapshot(duckdb_conn, snapshot_path):
+    """Copy the data table from an earlier snapshot; return False if none is usable."""
+    if not os.path.exists(snapshot_path):
+        return False
+    try:
+        duckdb_conn.execute(f"ATTACH {_sql_string(snapshot_path)} AS snapshot (READ_ONLY)")
+        try:
+            duckdb_conn.execute("CREATE TABLE data AS SELECT * FROM snapshot.data")
+        finally:
+            duckdb_conn.execute("DETACH snapshot")
+        os.utime(snapshot_path)  # Mark as recently used for pruning
+        return True
+    except Exception as e:
+        logger.warning("Ignoring unusable DuckDB snapshot %s: %s", snapshot_path, e)
+        duckdb_conn.execute("DROP TABLE IF EXISTS data")
+        return False
+
+
+def _save_snapshot(duckdb_conn, snapshot_path):
+    """Persist the loaded data table for later uploads, then prune old snapshots."""
+    tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(DUCKDB_SNAPSHOT_DIR, mode=0o700, exist_ok=True)
+        os.chmod(DUCKDB_SNAPSHOT_DIR, 0o700)  # makedirs leaves an existing dir's mode alone
+        duckdb_conn.execute(f"ATTACH {_sql_string(tmp_path)} AS snapshot")
+        try:
+            duckdb_conn.execute("CREATE TABLE snapshot.data AS SELECT * FROM data")
+        finally:
+            duckdb_conn.execute("DETACH snapshot")
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, snapshot_path)
+    except Exception as e:
+        logger.warning("Could not write DuckDB snapshot %s: %s", snapshot_path, e)
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return
+    _prune_snapshots()
+
+
+def _prune_snapshots():
+    """Delete least recently used snapshots until they fit DUCKDB_SNAPSHOT_MAX_BYTES."""
+    snapshots = []
+    with os.scandir(DUCKDB_SNAPSHOT_DIR) as entries:
+        for entry in entries:
+            if entry.name.startswith("csvagent-") and entry.name.endswith(".duckdb"):
+                stat = entry.stat()
+                snapshots.append((stat.st_atime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in snapshots)
+    for _, size, path in sorted(snapshots):
+        if total_size <= DUCKDB_SNAPSHOT_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+            total_size -= size
+        except OSError as e:
+            logger.warning("Could not prune DuckDB snapshot %s: %s", path, e)
+
+
+def _evict_executor(entry):
+    """Release the in-memory database held by a cached executor."""
+    _, engine = entry
+    try:
+        engine.dispose()
+    except Exception as e:
+        logger.warning("Failed to dispose cached agent engine: %s", e)
+
+
+def get_agent_executor(uploaded_file, prefix, llm):
+    """Return a SQL agent for the uploaded CSV, reusing one built for identical content and prompt."""
+    key = (hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).digest(), prefix)
+
+    with _EXECUTOR_CACHE_LOCK:
+        entry = _EXECUTOR_CACHE.get(key)
+        if entry is not None:
+            _EXECUTOR_CACHE.move_to_end(key)
+            return entry[0]
+
+    entry = _build_agent_executor(uploaded_file, key[0], prefix, llm)
+
+    with _EXECUTOR_CACHE_LOCK:
+        _EXECUTOR_CACHE[key] = entry
+        _EXECUTOR_CACHE.move_to_end(key)
+        evicted = []
+        while len(_EXECUTOR_CACHE) > EXECUTOR_CACHE_SIZE:
+            evicted.append(_EXECUTOR_CACHE.popitem(last=False)[1])
+
+    for old_entry in evicted:
+        _evict_executor(old_entry)
+    return entry[0]
+
+
+def _build_agent_executor(uploaded_file, digest, prefix, llm):
+    """Create an enhanced SQL agent with detailed feedback capabilities."""
+    # In-memory DuckDB; StaticPool hands every SQLAlchemy checkout the same
+    # connection so the agent's tools all see the table loaded below
+    engine = create_engine("duckdb:///:memory:",
+                          connect_args={"read_only": False},
+                          poolclass=StaticPool)
+
+    snapshot_path = _snapshot_path(digest)
+
+    # Load data and create the SQLDatabase using the same engine
+    with engine.connect() as conn:
+        try:
+            duckdb_conn = conn.connection.driver_connection
+
+            # Reuse the table parsed for an identical upload when a snapshot exists
+            loaded_from_snapshot = _load_snapshot(duckdb_conn, snapshot_path)
+            if not loaded_from_snapshot:
+                # Load CSV data into a table called 'data'
+                # Parse the upload in memory with Arrow's multithreaded reader and hand
+                # the columnar table straight to DuckDB - no temp CSV, no re-parse
+                arrow_table = pacsv.read_csv(io.BytesIO(uploaded_file.getvalue()))
+                duckdb_conn.register("arrow_tbl", arrow_table)
+                conn.execute(text("CREATE TABLE data AS SELECT * FROM arrow_tbl"))
+                duckdb_conn.unregister("arrow_tbl")
+            
+            # Row count and column schema in a single round-trip
+            row_count, columns = conn.execute(text(
+                "SELECT (SELECT COUNT(*) FROM data) AS rc, "
+                "(SELECT list({'n': column_name, 't': data_type} ORDER BY column_index) "
+                "FROM duckdb_columns() WHERE table_name = 'data') AS cols"
+            )).fetchone()
+            columns_info = [(col['n'], col['t']) for col in columns]
+            col_count = len(columns_info)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Loaded %d rows, %d columns into DuckDB: %s",
+                    row_count, col_count,
+                    [f'{col[0]} ({col[1]})' for col in columns_info]
+                )
+            
+            # Commit the transaction
+            conn.commit()
+
+            if not loaded_from_snapshot:
+                _save_snapshot(duckdb_conn, snapshot_path)
+            
+        except Exception as e:
+            logger.error("Error loading CSV data: %s", e)
+            raise Exception(f"Failed to load CSV data: {str(e)}")
+            
+    # Create enhanced SQLDatabase with the same engine
+    db = CachedSchemaSQLDatabase(
+        engine=engine, 
+        include_tables=['data'],
+        sample_rows_in_table_info=3,
+        max_string_length=1000,
+        lazy_table_reflection=False  # Force immediate table discovery
+    )
+    # Render schema + sample rows now; every sql_db_schema call reuses this string
+    db.get_table_info(['data'])
+    
+    # Verify the SQLDatabase can see and access the table
+    available_tables = db.get_usable_table_names()
+    logger.debug("SQLDatabase can see tables: %s", available_tables)
+    
+    if 'data' not in available_tables:
+        raise Exception("SQLDatabase cannot see the 'data' table - connection issue")
+
+    # Enhanced toolkit with better error handling
+    toolkit = MemoizedSQLDatabaseToolkit(
+        db=db, 
+        llm=llm,
+        reduce_k_below_max_tokens=True  # Automatically handle large result sets
+    )
+    
+    # Create a production-ready SQL agent with conservative settings
+    agent_executor = create_sql_agent(
+        llm=llm,
+        toolkit=toolkit,
+        verbose=True,
+        max_iterations=6,  # Reduced to minimize API calls and avoid rate limits
+        max_execution_time=AGENT_MAX_EXECUTION_TIME,
+        # Prefix goes in as a cache_control system block, so it is billed once per cache window
+        prompt=_agent_prompt(prefix),
+        # Native tool calling: structured tool_use blocks instead of a text scratchpad
+        agent_type="tool-calling",
+        early_stopping_method="force",
+    )
+    return CachedAgent(agent_executor), engine
@@ -3,62 +3,28 @@ Universal AI Agent for multimodal analysis using Claude Haiku
 Handles CSV, PDF, TXT, and Image files with advanced AI capabilities
 """
 
+import asyncio
+import functools
 import os
 import pandas as pd
 import tempfile
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 from langchain_anthropic import ChatAnthropic
-from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
 
 # Load environment variables
 load_dotenv()
 
-class UniversalInsightAgent:
-    """
-    Multimodal AI agent that can analyze different file types
-    """
-    
-    def __init__(self):
-        self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-        self.is_test_mode = self.anthropic_api_key == "sk-ant-REDACTED"
-        self.claude_model = None
-        self.model_error = None
-        
-        # Initialize Claude model with error handling to prevent UI blocking
-        if not self.is_test_mode:
-            try:
-                self.claude_model = ChatAnthropic(
-                    model="claude-3-haiku-20240307",
-                    temperature=0,
-                    anthropic_api_key=self.anthropic_api_key,
-                    timeout=10  # Add timeout to prevent hanging
-                )
-            except Exception as e:
-                self.model_error = str(e)
-                self.is_test_mode = True  # Fall back to test mode on error
-        
-        # CSV analysis - now using direct Claude analysis instead of SQL agent
-        self.current_db_path = None
-    
-    def cleanup_database(self):
-        """Clean up temporary database files"""
-        if self.current_db_path and os.path.exists(self.current_db_path):
-            try:
-                os.unlink(self.current_db_path)
-                self.current_db_path = None
-            except Exception:
-                pass  # Ignore cleanup errors
-
-    def analyze_csv(self, processed_data: Dict[str, Any], user_question: str) -> str:
-        """Analyze CSV data using direct Claude analysis"""
-        try:
-            # Get the text summary and metadata
-            text_summary = processed_data['text_summary']
-            metadata = processed_data['metadata']
-            
-            # Create enhanced prompt for CSV analysis
-            system_prompt = """You are an expert data analyst. Your task is to analyze the provided CSV dataset summary and answer the user's question comprehensively.
+# Static system prompts live at module scope so every request sends a
+# byte-identical prefix, which is what Anthropic's prompt cache keys on.
+CSV_SYSTEM_PROMPT = """You are an expert data analyst. Your task is to analyze the provided CSV dataset summary and answer the user's question comprehensively.
 
 Provide insights that are:
 1. Directly relevant to the user's question
@@ -69,42 +35,7 @@ Provide insights that are:
 
 Be thorough but concise in your analysis."""
 
-            user_prompt = f"""
-CSV Dataset Analysis Request:
-
-Dataset Summary:
-{text_summary}
-
-Dataset Metadata:
-- Rows: {metadata.get('rows', 'unknown')}
-- Columns: {metadata.get('columns', 'unknown')}
-- Column Names: {', '.join(metadata.get('column_names', []))}
-
-User Question: {user_question}
-
-Please provide a comprehensive analysis addressing the user's question with specific insights, patterns, and recommendations based on the dataset characteristics provided.
-"""
-
-            # Use Claude for analysis
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
-            
-            response = self.claude_model.invoke(messages)
-            return response.content
-            
-        except Exception as e:
-            return f"Error analyzing CSV: {str(e)}"
-    
-    def analyze_text(self, processed_data: Dict[str, Any], user_question: str) -> str:
-        """Analyze text content (PDF or TXT)"""
-        try:
-            text_content = processed_data['content']
-            metadata = processed_data['metadata']
-            
-            # Create enhanced prompt for text analysis
-            system_prompt = """You are an expert text analyzer. Your task is to carefully read and analyze the provided text content to answer the user's question comprehensively. 
+TEXT_SYSTEM_PROMPT = """You are an expert text analyzer. Your task is to carefully read and analyze the provided text content to answer the user's question comprehensively. 
 
 Provide insights that are:
 1. Directly relevant to the user's question
@@ -114,42 +45,7 @@ Provide insights that are:
 
 Be thorough but concise in your analysis."""
 
-            user_prompt = f"""
-Text Content Analysis Request:
-
-Document Metadata:
-- Type: {processed_data['type'].upper()}
-- Length: {metadata.get('text_length', 'unknown')} characters
-- Word count: {metadata.get('word_count', 'unknown')} words
-{f"- Pages: {metadata.get('pages', 'unknown')}" if 'pages' in metadata else ""}
-
-User Question: {user_question}
-
-Text Content:
-{text_content[:8000]}{"..." if len(text_content) > 8000 else ""}
-
-Please analyze the above text content and provide a comprehensive answer to the user's question.
-"""
-
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
-            
-            response = self.claude_model.invoke(messages)
-            return response.content
-            
-        except Exception as e:
-            return f"Error analyzing text: {str(e)}"
-    
-    def analyze_image(self, processed_data: Dict[str, Any], user_question: str) -> str:
-        """Analyze image content using Claude's vision capabilities"""
-        try:
-            base64_image = processed_data['content']  # Fixed: content field, not base64
-            metadata = processed_data['metadata']
-            
-            # Create enhanced prompt for image analysis
-            system_prompt = """You are an expert image analyzer with capabilities to extract and interpret information from various types of images including:
+IMAGE_SYSTEM_PROMPT = """You are an expert image analyzer with capabilities to extract and interpret information from various types of images including:
 - Charts, graphs, and data visualizations
 - Screenshots of text, tables, and documents
 - Diagrams, flowcharts, and technical drawings
@@ -164,54 +60,325 @@ Provide analysis that is:
 4. Describes relationships, patterns, or trends shown
 5. Professional and thorough"""
 
-            user_prompt = f"""
+# Per-request prompt scaffolding, filled in with str.format
+CSV_USER_PROMPT_TEMPLATE = """
+CSV Dataset Analysis Request:
+
+Dataset Summary:
+{text_summary}
+
+Dataset Metadata:
+- Rows: {rows}
+- Columns: {columns}
+- Column Names: {column_names}
+
+User Question: {user_question}
+
+Please provide a comprehensive analysis addressing the user's question with specific insights, patterns, and recommendations based on the dataset characteristics provided.
+"""
+
+TEXT_DOCUMENT_PROMPT_TEMPLATE = """
+Text Content Analysis Request:
+
+Document Metadata:
+- Type: {doc_type}
+- Length: {text_length} characters
+- Word count: {word_count} words
+{pages_line}
+
+Text Content:
+{text_content}
+"""
+
+TEXT_QUESTION_PROMPT_TEMPLATE = """
+User Question: {user_question}
+
+Please analyze the above text content and provide a comprehensive answer to the user's question.
+"""
+
+IMAGE_USER_PROMPT_TEMPLATE = """
 Image Analysis Request:
 
 Image Metadata:
-- Format: {metadata.get('format', 'unknown')}
-- Size: {metadata.get('width', 'unknown')} x {metadata.get('height', 'unknown')} pixels
-- File size: {metadata.get('file_size_bytes', 'unknown')} bytes
+- Format: {format}
+- Size: {width} x {height} pixels
+- File size: {file_size_bytes} bytes
 
 User Question: {user_question}
 
 Please analyze the provided image and answer the user's question based on what you can see in the image. If the image contains text, data, charts, or other specific information, please extract and interpret it accurately.
 """
 
-            # Determine the correct media type based on image format
-            image_format = metadata.get('format', 'JPEG').lower()
-            # Map common formats to their MIME types
-            format_to_mime = {
-                'png': 'image/png',
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'gif': 'image/gif',
-                'webp': 'image/webp',
-                'bmp': 'image/bmp'
-            }
-            media_type = format_to_mime.get(image_format, 'image/jpeg')
-
-            # Create message with image
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=[
-                    {
-                        "type": "text", 
-                        "text": user_prompt
+# Map common image formats to their MIME types
+FORMAT_TO_MIME = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'bmp': 'image/bmp'
+}
+
+# Document text sent to Claude is capped by tokens rather than characters
+TEXT_TOKEN_BUDGET = 6000
+# Character cap used when no tokenizer is available
+TEXT_CHAR_BUDGET = 8000
+# Upper bound on characters per token, used to avoid encoding huge documents
+MAX_CHARS_PER_TOKEN = 8
+
+# Beta header that enables cache_control blocks on the Messages API
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+
+def cached_system_message(prompt: str) -> SystemMessage:
+    """Wrap a static system prompt in a content block marked for prompt caching"""
+    return SystemMessage(content=[
+        {
+            "type": "text",
+            "text": prompt,
+            "cache_control": {"type": "ephemeral"}
+        }
+    ])
+
+
+@functools.lru_cache(maxsize=1)
+def _get_claude_model(api_key: str) -> ChatAnthropic:
+    """Claude client shared by every agent so HTTP connections are reused"""
+    return ChatAnthropic(
+        model="claude-3-haiku-20240307",
+        temperature=0,
+        anthropic_api_key=api_key,
+        timeout=10,  # Add timeout to prevent hanging
+        default_headers=PROMPT_CACHING_HEADERS
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _get_text_encoding():
+    """Tokenizer used to budget document text, or None if tiktoken is unavailable"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def truncate_to_token_budget(text: str, budget: int = TEXT_TOKEN_BUDGET) -> str:
+    """Trim text to at most `budget` tokens, appending an ellipsis when cut"""
+    encoding = _get_text_encoding()
+    if encoding is None:
+        if len(text) > TEXT_CHAR_BUDGET:
+            return text[:TEXT_CHAR_BUDGET] + "..."
+        return text
+
+    # Only encode a window that can hold the budget, not the whole document
+    window = budget * MAX_CHARS_PER_TOKEN
+    was_cut = len(text) > window
+    tokens = encoding.encode(text[:window])
+    if len(tokens) > budget:
+        return encoding.decode(tokens[:budget]) + "..."
+    if was_cut:
+        return text[:window] + "..."
+    return text
+
+
+class UniversalInsightAgent:
+    """
+    Multimodal AI agent that can analyze different file types
+    """
+    
+    def __init__(self):
+        self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+        self.is_test_mode = self.anthropic_api_key == "sk-ant-REDACTED"
+        self._claude_model = None
+        self.model_error = None
+
+    @property
+    def claude_model(self) -> Optional[ChatAnthropic]:
+        """Claude client, built on first access so importing this module stays cheap"""
+        if self._claude_model is None and not self.is_test_mode:
+            # Initialize Claude model with error handling to prevent UI blocking
+            try:
+                self._claude_model = _get_claude_model(self.anthropic_api_key)
+            except Exception as e:
+                self.model_error = str(e)
+                self.is_test_mode = True  # Fall back to test mode on error
+        return self._claude_model
+
+    def _build_csv_messages(self, processed_data: Dict[str, Any], user_question: str) -> List[BaseMessage]:
+        """Build the Claude messages for a CSV analysis request"""
+        # Get the text summary and metadata
+        text_summary = processed_data['text_summary']
+        metadata = processed_data['metadata']
+        
+        user_prompt = CSV_USER_PROMPT_TEMPLATE.format(
+            text_summary=text_summary,
+            rows=metadata.get('rows', 'unknown'),
+            columns=metadata.get('columns', 'unknown'),
+            column_names=', '.join(metadata.get('column_names', [])),
+            user_question=user_question
+        )
+
+        # Use Claude for analysis
+        messages = [
+            cached_system_message(CSV_SYSTEM_PROMPT),
+            HumanMessage(content=user_prompt)
+        ]
+        return messages
+
+    def analyze_csv(self, processed_data: Dict[str, Any], user_question: str) -> str:
+        """Analyze CSV data using direct Claude analysis"""
+        try:
+            response = self.claude_model.invoke(self._build_csv_messages(processed_data, user_question))
+            return response.content
+            
+        except Exception as e:
+            return f"Error analyzing CSV: {str(e)}"
+
+    async def analyze_csv_async(self, processed_data: Dict[str, Any], user_question: str) -> str:
+        """Async variant of analyze_csv that awaits the API call instead of blocking"""
+        try:
+            response = await self.claude_model.ainvoke(self._build_csv_messages(processed_data, user_question))
+            return response.content
+            
+        except Exception as e:
+            return f"Error analyzing CSV: {str(e)}"
+
+    def analyze_csv_stream(self, processed_data: Dict[str, Any], user_question: str) -> Iterator[str]:
+        """Streaming variant of analyze_csv that yields text as Claude generates it"""
+        return self._stream(self._build_csv_messages(processed_data, user_question), "CSV")
+    
+    def _build_text_messages(self, processed_data: Dict[str, Any], user_question: str) -> List[BaseMessage]:
+        """Build the Claude messages for a text analysis request"""
+        text_content = processed_data['content']
+        metadata = processed_data['metadata']
+        
+        document_prompt = TEXT_DOCUMENT_PROMPT_TEMPLATE.format(
+            doc_type=processed_data['type'].upper(),
+            text_length=metadata.get('text_length', 'unknown'),
+            word_count=metadata.get('word_count', 'unknown'),
+            pages_line=f"- Pages: {metadata.get('pages', 'unknown')}" if 'pages' in metadata else "",
+            text_content=truncate_to_token_budget(text_content)
+        )
+
+        user_prompt = TEXT_QUESTION_PROMPT_TEMPLATE.format(user_question=user_question)
+
+        # The document block is identical for every question on the same file,
+        # so it is marked for caching ahead of the per-question text
+        messages = [
+            cached_system_message(TEXT_SYSTEM_PROMPT),
+            HumanMessage(content=[
+                {
+                    "type": "text",
+                    "text": document_prompt,
+                    "cache_control": {"type": "ephemeral"}
+                },
+                {
+                    "type": "text",
+                    "text": user_prompt
+                }
+            ])
+        ]
+        return messages
+
+    def analyze_text(self, processed_data: Dict[str, Any], user_question: str) -> str:
+        """Analyze text content (PDF or TXT)"""
+        try:
+            response = self.claude_model.invoke(self._build_text_messages(processed_data, user_question))
+            return response.content
+            
+        except Exception as e:
+            return f"Error analyzing text: {str(e)}"
+
+    async def analyze_text_async(self, processed_data: Dict[str, Any], user_question: str) -> str:
+        """Async variant of analyze_text that awaits the API call instead of blocking"""
+        try:
+            response = await self.claude_model.ainvoke(self._build_text_messages(processed_data, user_question))
+            return response.content
+            
+        except Exception as e:
+            return f"Error analyzing text: {str(e)}"
+
+    def analyze_text_stream(self, processed_data: Dict[str, Any], user_question: str) -> Iterator[str]:
+        """Streaming variant of analyze_text that yields text as Claude generates it"""
+        return self._stream(self._build_text_messages(processed_data, user_question), "text")
+    
+    def _build_image_messages(self, processed_data: Dict[str, Any], user_question: str) -> List[BaseMessage]:
+        """Build the Claude messages for an image analysis request"""
+        base64_image = processed_data['content']  # Fixed: content field, not base64
+        metadata = processed_data['metadata']
+        
+        user_prompt = IMAGE_USER_PROMPT_TEMPLATE.format(
+            format=metadata.get('format', 'unknown'),
+            width=metadata.get('width', 'unknown'),
+            height=metadata.get('height', 'unknown'),
+            file_size_bytes=metadata.get('file_size_bytes', 'unknown'),
+            user_question=user_question
+        )
+
+        # Determine the correct media type based on image format
+        image_format = metadata.get('format', 'JPEG').lower()
+        media_type = FORMAT_TO_MIME.get(image_format, 'image/jpeg')
+
+        # Anthropic-native image block takes the base64 payload as-is (no data:
+        # URI copy) and is cached so follow-up questions reuse the image tokens
+        messages = [
+            cached_system_message(IMAGE_SYSTEM_PROMPT),
+            HumanMessage(content=[
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": media_type,
+                        "data": base64_image
                     },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{media_type};base64,{base64_image}"
-                        }
-                    }
-                ])
-            ]
+                    "cache_control": {"type": "ephemeral"}
+                },
+                {
+                    "type": "text", 
+                    "text": user_prompt
+                }
+            ])
+        ]
+        return messages
+
+    def analyze_image(self, processed_data: Dict[str, Any], user_question: str) -> str:
+        """Analyze image content using Claude's vision capabilities"""
+        try:
+            response = self.claude_model.invoke(self._build_image_messages(processed_data, user_question))
+            return response.content
             
-            response = self.claude_model.invoke(messages)
+        except Exception as e:
+            return f"Error analyzing image: {str(e)}"
+
+    async def analyze_image_async(self, processed_data: Dict[str, Any], user_question: str) -> str:
+        """Async variant of analyze_image that awaits the API call instead of blocking"""
+        try:
+            response = await self.claude_model.ainvoke(self._build_image_messages(processed_data, user_question))
             return response.content
             
         except Exception as e:
             return f"Error analyzing image: {str(e)}"
+
+    def analyze_image_stream(self, processed_data: Dict[str, Any], user_question: str) -> Iterator[str]:
+        """Streaming variant of analyze_image that yields text as Claude generates it"""
+        return self._stream(self._build_image_messages(processed_data, user_question), "image")
+
+    def _stream(self, messages: List[BaseMessage], label: str) -> Iterator[str]:
+        """Yield response text chunks, or an error message if the call fails before any text"""
+        streamed = False
+        try:
+            for chunk in self.claude_model.stream(messages):
+                if chunk.content:
+                    streamed = True
+                    yield chunk.content
+                    
+        except Exception as e:
+            # Text already shown can't be turned into an error message; let the caller handle it
+            if streamed:
+                raise
+            yield f"Error analyzing {label}: {str(e)}"
     
     def analyze_content(self, processed_data: Dict[str, Any], user_question: str) -> str:
         """Main analysis function that routes to appropriate analyzer"""
@@ -230,6 +397,46 @@ Please analyze the provided image and answer the user's question based on what y
         else:
             return f"Unsupported content type: {content_type}"
     
+    async def analyze_content_async(self, processed_data: Dict[str, Any], user_question: str) -> str:
+        """Async variant of analyze_content for callers that await many files at once"""
+        content_type = processed_data.get('type')
+        
+        # Test mode - return mock responses
+        if self.is_test_mode:
+            return self._get_test_mode_response(content_type, user_question, processed_data)
+        
+        if content_type == 'csv':
+            return await self.analyze_csv_async(processed_data, user_question)
+        elif content_type in ['pdf', 'text']:
+            return await self.analyze_text_async(processed_data, user_question)
+        elif content_type == 'image':
+            return await self.analyze_image_async(processed_data, user_question)
+        else:
+            return f"Unsupported content type: {content_type}"
+
+    def analyze_content_stream(self, processed_data: Dict[str, Any], user_question: str) -> Iterator[str]:
+        """Streaming variant of analyze_content; suitable for st.write_stream"""
+        content_type = processed_data.get('type')
+        
+        # Test mode - return mock responses
+        if self.is_test_mode:
+            return iter([self._get_test_mode_response(content_type, user_question, processed_data)])
+        
+        if content_type == 'csv':
+            return self.analyze_csv_stream(processed_data, user_question)
+        elif content_type in ['pdf', 'text']:
+            return self.analyze_text_stream(processed_data, user_question)
+        elif content_type == 'image':
+            return self.analyze_image_stream(processed_data, user_question)
+        else:
+            return iter([f"Unsupported content type: {content_type}"])
+    
+    async def analyze_batch_async(self, batch: List[Tuple[Dict[str, Any], str]]) -> List[str]:
+        """Analyze several (processed_data, question) pairs concurrently, preserving order"""
+        return await asyncio.gather(
+            *(self.analyze_content_async(processed_data, question) for processed_data, question in batch)
+        )
+    
     def _get_test_mode_response(self, content_type: str, user_question: str, processed_data: Dict[str, Any]) -> str:
         """Generate mock responses for test mode"""
         if content_type == 'csv':
@@ -289,14 +496,6 @@ The document presents comprehensive analysis with actionable insights. It covers
         else:
             return f"**Test Mode:** Mock analysis for {content_type} file type. Your question: '{user_question}'"
     
-    def cleanup(self):
-        """Clean up temporary resources"""
-        if self.current_db_path and os.path.exists(self.current_db_path):
-            try:
-                os.unlink(self.current_db_path)
-            except:
-                pass
-    
     def get_content_summary(self, processed_data: Dict[str, Any]) -> str:
         """Get a brief summary of the processed content"""
         content_type = processed_data.get('type')
@@ -313,5 +512,7 @@ The document presents comprehensive analysis with actionable insights. It covers
         else:
             return f"Unknown content type: {content_type}"
 
-# Singleton instance
-universal_agent = UniversalInsightAgent()
+@functools.lru_cache(maxsize=1)
+def get_universal_agent() -> UniversalInsightAgent:
+    """Shared agent instance, created on first request rather than at import"""
+    return UniversalInsightAgent()
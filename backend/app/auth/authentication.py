@@ -1,10 +1,42 @@
 import streamlit as st
 import os
-from .supabase_client import supabase_client
+import time
+from .supabase_client import supabase_client, AuthApiError, AuthRetryableError
 from ..utils.logging_config import get_logger
 
 logger = get_logger('csv_analyzer')
 
+# Exact session_state keys dropped alongside every 'ui_' key on login/logout
+_CLEAR_KEYS = frozenset({'messages', 'processed_content', 'file_type', 'uploaded_file_name'})
+
+def _clear_ui_state():
+    """Remove per-user UI state from the Streamlit session."""
+    for key in [k for k in st.session_state if k.startswith('ui_') or k in _CLEAR_KEYS]:
+        st.session_state.pop(key, None)
+
+# Seconds a "no existing session" result is trusted before Supabase is asked again
+SESSION_CHECK_TTL = 60
+
+def get_session_user():
+    """
+    Return the user of an existing Supabase session, or None.
+    
+    Streamlit reruns the script on every interaction, so the network lookup is
+    made at most once per SESSION_CHECK_TTL for each browser session.
+    """
+    checked_at = st.session_state.get('_session_checked_at')
+    if checked_at is not None and time.monotonic() - checked_at < SESSION_CHECK_TTL:
+        return None
+    st.session_state['_session_checked_at'] = time.monotonic()
+    
+    client = supabase_client()
+    if not client:
+        return None
+    session = client.auth.get_session()
+    if session and session.user:
+        return session.user
+    return None
+
 def display_auth_form():
     """
     Simple, clean authentication form that prioritizes fallback mode.
@@ -28,11 +60,13 @@ def display_auth_form():
 
     # Third priority: Try to get existing session (but don't fail hard)
     try:
-        if supabase_client:
-            session = supabase_client.auth.get_session()
-            if session and session.user:
-                st.session_state['user'] = session.user
-                return session.user
+        session_user = get_session_user()
+        if session_user:
+            st.session_state['user'] = session_user
+            return session_user
+    except (AuthApiError, AuthRetryableError) as e:
+        # Expected for expired/revoked sessions or a Supabase hiccup - just show login forms
+        logger.debug("Session check rejected (will show login forms): %s", e)
     except Exception as e:
         # Log the error but don't show it to user - just proceed to login forms
         logger.error(f"Session check failed (will show login forms): {str(e)}")
@@ -52,16 +86,14 @@ def display_auth_form():
                     st.error("Please fill in all fields")
                 else:
                     try:
-                        user_session = supabase_client.auth.sign_in_with_password({
+                        user_session = supabase_client().auth.sign_in_with_password({
                             "email": email,
                             "password": password
                         })
                         
                         if user_session.user:
                             # Clear any existing UI states
-                            for key in list(st.session_state.keys()):
-                                if key.startswith('ui_') or key in ['messages', 'processed_content', 'file_type']:
-                                    st.session_state.pop(key, None)
+                            _clear_ui_state()
                                     
                             st.session_state['user'] = user_session.user
                             st.session_state['authenticated'] = True  # Explicitly mark as authenticated
@@ -93,16 +125,14 @@ def display_auth_form():
                     st.error("Password must be at least 6 characters long")
                 else:
                     try:
-                        user_session = supabase_client.auth.sign_up({
+                        user_session = supabase_client().auth.sign_up({
                             "email": email,
                             "password": password
                         })
                         
                         if user_session.user:
                             # Clear any existing UI states
-                            for key in list(st.session_state.keys()):
-                                if key.startswith('ui_') or key in ['messages', 'processed_content', 'file_type']:
-                                    st.session_state.pop(key, None)
+                            _clear_ui_state()
                                     
                             st.session_state['user'] = user_session.user
                             st.session_state['authenticated'] = True  # Explicitly mark as authenticated
@@ -111,15 +141,13 @@ def display_auth_form():
                             st.rerun()
                         else:
                             try:
-                                user_session = supabase_client.auth.sign_in_with_password({
+                                user_session = supabase_client().auth.sign_in_with_password({
                                     "email": email,
                                     "password": password
                                 })
                                 if user_session.user:
                                     # Clear any existing UI states
-                                    for key in list(st.session_state.keys()):
-                                        if key.startswith('ui_') or key in ['messages', 'processed_content', 'file_type']:
-                                            st.session_state.pop(key, None)
+                                    _clear_ui_state()
                                             
                                     st.session_state['user'] = user_session.user
                                     st.session_state['authenticated'] = True  # Explicitly mark as authenticated
@@ -153,9 +181,7 @@ def handle_logout():
             del st.session_state['authenticated']
             
         # Clear all UI state
-        for key in list(st.session_state.keys()):
-            if key.startswith('ui_') or key in ['messages', 'processed_content', 'file_type', 'uploaded_file_name']:
-                st.session_state.pop(key, None)
+        _clear_ui_state()
         
         logger.info("User logged out")
         st.rerun()
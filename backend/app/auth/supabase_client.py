@@ -1,10 +1,36 @@
+import functools
 import os
+from typing import Optional
+import httpx
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+
+# Auth errors raised by the Supabase SDK; the auth package was renamed from
+# gotrue to supabase_auth in later supabase-py releases
+try:
+    from supabase_auth.errors import AuthApiError, AuthRetryableError
+except ImportError:
+    from gotrue.errors import AuthApiError, AuthRetryableError
 from app.config.settings import settings
 from app.utils.logging_config import get_logger
 
 logger = get_logger('csv_analyzer')
 
+
+def _pooled_client_options() -> Optional[ClientOptions]:
+    """
+    Client options sharing one keep-alive HTTP pool between the auth and REST
+    sub-clients, so repeat calls reuse TCP/TLS connections. Returns None on
+    supabase-py releases whose ClientOptions cannot take an httpx client.
+    """
+    if 'httpx_client' not in getattr(ClientOptions, '__dataclass_fields__', {}):
+        return None
+    http_client = httpx.Client(
+        transport=httpx.HTTPTransport(retries=1),
+        limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=30.0)
+    )
+    return ClientOptions(httpx_client=http_client)
+
 class SupabaseManager:
     """
     Professional Supabase client manager for CSV Analyzer Pro.
@@ -34,8 +60,13 @@ class SupabaseManager:
                     cls._client = None
                     return cls._client
                 
-                cls._client = create_client(url, key)
-                logger.info("Supabase client initialized successfully")
+                options = _pooled_client_options()
+                if options is not None:
+                    cls._client = create_client(url, key, options=options)
+                else:
+                    cls._client = create_client(url, key)
+                # The id makes a second initialisation in one process easy to spot in logs
+                logger.info(f"Supabase client initialized successfully (id={id(cls._client):#x})")
                 
             except Exception as e:
                 logger.warning(f"Failed to initialize Supabase client (test mode): {e}")
@@ -43,8 +74,11 @@ class SupabaseManager:
         
         return cls._client
 
-# Global Supabase client instance (can be None in test mode)
-try:
-    supabase_client = SupabaseManager.get_client()
-except Exception:
-    supabase_client = None
+# Global Supabase client (None in test mode), created on first use rather than
+# at import so cold starts don't block on client setup
+@functools.lru_cache(maxsize=1)
+def supabase_client() -> Optional[Client]:
+    try:
+        return SupabaseManager.get_client()
+    except Exception:
+        return None
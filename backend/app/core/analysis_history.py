@@ -1,22 +1,50 @@
 import json
 import os
+import sys
 import hashlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Any, Tuple
+from dataclasses import dataclass, fields
 from enum import Enum
 
 from app.utils.logging_config import get_logger, log_performance
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 logger = get_logger('csv_analyzer')
 
+# Characters encoded per hash update when hashing str content
+HASH_CHUNK_CHARS = 65536
+
+
+def _encode_record(record: Dict) -> bytes:
+    """Serialize a record as one UTF-8 JSONL line."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(record, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode('utf-8')
+
+
+# Both accept the raw bytes read from disk, so no separate decode pass is needed
+_decode_json = orjson.loads if ORJSON_AVAILABLE else json.loads
+
 class ExportFormat(Enum):
     PDF = "pdf"
     EXCEL = "xlsx"
     CSV = "csv"
     JSON = "json"
 
-@dataclass
+# dataclass(slots=True) needs Python 3.10+; the Docker image still runs 3.9
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(**_DATACLASS_SLOTS)
 class AnalysisRecord:
     """Represents a single analysis record."""
     id: str
@@ -32,7 +60,11 @@ class AnalysisRecord:
     
     def __post_init__(self):
         if self.created_at is None:
-            self.created_at = datetime.now().isoformat()
+            self.created_at = datetime.now().isoformat(timespec='seconds')
+
+# Field names resolved once; records hold only primitives, so a shallow dict
+# replaces asdict()'s recursive deep copy
+_RECORD_FIELD_NAMES = tuple(f.name for f in fields(AnalysisRecord))
 
 class AnalysisHistoryManager:
     """
@@ -52,51 +84,91 @@ class AnalysisHistoryManager:
         'enterprise': 90 # 90 days for enterprise users
     }
     
+    # Parsed histories kept in memory, least recently used evicted first
+    HISTORY_CACHE_SIZE = 256
+    
     def __init__(self, storage_path: str = "analysis_history"):
         self.storage_path = storage_path
         os.makedirs(storage_path, exist_ok=True)
+        # user_id -> ((st_mtime_ns, st_size), parsed records, records by id)
+        self._cache: "OrderedDict[str, Tuple[Tuple[int, int], List[Dict], Dict[str, Dict]]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Serializes appends, cache restamps and cleanup rewrites so none of them
+        # can drop a record another thread is writing
+        self._append_lock = threading.Lock()
         logger.info(f"Analysis history manager initialized with storage: {storage_path}")
     
     def _get_user_history_file(self, user_id: str) -> str:
-        """Get the file path for user's analysis history."""
-        return os.path.join(self.storage_path, f"user_{user_id}_history.json")
+        """Get the file path for user's analysis history (one JSON record per line)."""
+        return os.path.join(self.storage_path, f"user_{user_id}_history.jsonl")
+    
+    def _migrate_legacy_history(self, user_id: str, file_path: str) -> None:
+        """Convert a legacy JSON-array history file to JSONL, once."""
+        legacy_path = os.path.join(self.storage_path, f"user_{user_id}_history.json")
+        if os.path.exists(file_path) or not os.path.exists(legacy_path):
+            return
+        
+        try:
+            with open(legacy_path, 'rb') as f:
+                history = _decode_json(f.read())
+            # JSONL files are kept in append (timestamp) order
+            history.sort(key=lambda x: x['timestamp'])
+            if self._save_user_history(user_id, history):
+                os.remove(legacy_path)
+                logger.info(f"Migrated history for user {user_id} to JSONL")
+        except Exception as e:
+            logger.error(f"Error migrating history for user {user_id}: {e}")
     
     def _generate_analysis_id(self, user_id: str, question: str, timestamp: str) -> str:
         """Generate a unique analysis ID."""
         content = f"{user_id}_{question}_{timestamp}"
-        return hashlib.md5(content.encode()).hexdigest()[:12]
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=6).hexdigest()
     
     def _calculate_file_hash(self, file_content: Any) -> str:
         """Calculate hash of uploaded file for deduplication."""
-        if isinstance(file_content, bytes):
-            return hashlib.sha256(file_content).hexdigest()[:16]
+        digest = hashlib.blake2b(digest_size=8)
+        if isinstance(file_content, (bytes, bytearray, memoryview)):
+            digest.update(file_content)
+            return digest.hexdigest()
         elif isinstance(file_content, str):
-            return hashlib.sha256(file_content.encode('utf-8')).hexdigest()[:16]
+            # Encode in slices so a large text never needs a full-size bytes copy
+            for start in range(0, len(file_content), HASH_CHUNK_CHARS):
+                digest.update(file_content[start:start + HASH_CHUNK_CHARS].encode('utf-8'))
+            return digest.hexdigest()
         
         # Fallback for other types, like dictionaries from file_processor
         try:
-            # Attempt to serialize to JSON string then hash
-            serialized_content = json.dumps(file_content, sort_keys=True, default=str)
-            return hashlib.sha256(serialized_content.encode('utf-8')).hexdigest()[:16]
+            if isinstance(file_content, dict):
+                # Feed items incrementally instead of serializing the whole structure first
+                for key in sorted(file_content, key=str):
+                    digest.update(str(key).encode('utf-8') + b"\0")
+                    digest.update(repr(file_content[key]).encode('utf-8') + b"\0")
+            else:
+                digest.update(json.dumps(file_content, sort_keys=True, default=str).encode('utf-8'))
+            return digest.hexdigest()
         except Exception as e:
             logger.warning(f"Could not hash file content of type {type(file_content)}: {e}")
             # Return a default hash if serialization fails
-            return hashlib.sha256(b"unhashable_content").hexdigest()[:16]
+            return hashlib.blake2b(b"unhashable_content", digest_size=8).hexdigest()
 
     @log_performance
     def save_analysis(self, user_id: str, filename: str, question: str, 
                      response: str, file_content: Any, execution_time: float,
-                     subscription_tier: str = "free") -> str:
+                     subscription_tier: str = "free", file_hash: Optional[str] = None) -> str:
         """
-        Save an analysis record.
+        Save an analysis record. A precomputed file_hash (see
+        UniversalFileProcessor.compute_hash) skips hashing file_content.
         
         Returns:
             str: Analysis ID
         """
         try:
-            timestamp = datetime.now().isoformat()
-            file_hash = self._calculate_file_hash(file_content)
-            analysis_id = self._generate_analysis_id(user_id, question, timestamp)
+            now = datetime.now()
+            timestamp = now.isoformat(timespec='seconds')
+            if file_hash is None:
+                file_hash = self._calculate_file_hash(file_content)
+            # The id keeps full precision so repeat questions within a second stay distinct
+            analysis_id = self._generate_analysis_id(user_id, question, now.isoformat())
             
             # Create analysis record
             record = AnalysisRecord(
@@ -111,14 +183,8 @@ class AnalysisHistoryManager:
                 subscription_tier=subscription_tier
             )
             
-            # Load existing history
-            history = self._load_user_history(user_id)
-            
-            # Add new record
-            history.append(asdict(record))
-            
-            # Save updated history
-            self._save_user_history(user_id, history)
+            # Append the new record without rewriting prior history
+            self._append_record(user_id, {name: getattr(record, name) for name in _RECORD_FIELD_NAMES})
             
             logger.info(f"Analysis saved for user {user_id}: {analysis_id}")
             return analysis_id
@@ -127,26 +193,104 @@ class AnalysisHistoryManager:
             logger.error(f"Error saving analysis for user {user_id}: {e}")
             raise
     
-    def _load_user_history(self, user_id: str) -> List[Dict]:
-        """Load user's analysis history."""
+    @staticmethod
+    def _file_stamp(file_path: str) -> Optional[Tuple[int, int]]:
+        """Return (mtime_ns, size) identifying the file's current contents, or None."""
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def _cache_get(self, user_id: str,
+                   stamp: Optional[Tuple[int, int]]) -> Optional[Tuple[List[Dict], Dict[str, Dict]]]:
+        """Return the cached (history, id index) if parsed from a file with this stamp."""
+        with self._cache_lock:
+            cached = self._cache.get(user_id)
+            if cached is None or cached[0] != stamp:
+                return None
+            self._cache.move_to_end(user_id)
+            return cached[1], cached[2]
+    
+    def _cache_put(self, user_id: str, stamp: Tuple[int, int], history: List[Dict],
+                   by_id: Optional[Dict[str, Dict]] = None) -> None:
+        """Store a parsed history and its id index, evicting the least recently used users."""
+        if by_id is None:
+            by_id = {record['id']: record for record in history}
+        with self._cache_lock:
+            self._cache[user_id] = (stamp, history, by_id)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.HISTORY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+    
+    def _append_record(self, user_id: str, record: Dict) -> None:
+        """Append a single record to the user's history file."""
         file_path = self._get_user_history_file(user_id)
+        self._migrate_legacy_history(user_id, file_path)
         
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading history for user {user_id}: {e}")
-                return []
+        data = _encode_record(record)
+        with self._append_lock:
+            stamp = self._file_stamp(file_path)
+            cached = self._cache_get(user_id, stamp)
+            with open(file_path, 'ab') as f:
+                f.write(data)
+            
+            if cached is None:
+                return
+            # Keep an up-to-date cache entry current instead of re-parsing next read,
+            # unless the file grew by more than this record (another writer got in)
+            new_stamp = self._file_stamp(file_path)
+            if new_stamp is None or new_stamp[1] != (stamp[1] if stamp else 0) + len(data):
+                with self._cache_lock:
+                    self._cache.pop(user_id, None)
+                return
+            history, by_id = cached
+            history.append(record)
+            by_id[record['id']] = record
+            self._cache_put(user_id, new_stamp, history, by_id)
+    
+    def _load_user_entry(self, user_id: str) -> Tuple[List[Dict], Dict[str, Dict]]:
+        """Load user's analysis history along with an id -> record index."""
+        file_path = self._get_user_history_file(user_id)
+        self._migrate_legacy_history(user_id, file_path)
         
-        return []
+        stamp = self._file_stamp(file_path)
+        if stamp is None:
+            return [], {}
+        
+        # Only re-parse when the file changed since it was last read
+        cached = self._cache_get(user_id, stamp)
+        if cached is not None:
+            return cached
+        
+        try:
+            with open(file_path, 'rb') as f:
+                history = [_decode_json(line) for line in f if line.strip()]
+            by_id = {record['id']: record for record in history}
+            self._cache_put(user_id, stamp, history, by_id)
+            return history, by_id
+        except Exception as e:
+            logger.error(f"Error loading history for user {user_id}: {e}")
+            return [], {}
+    
+    def _load_user_history(self, user_id: str) -> List[Dict]:
+        """Load user's analysis history."""
+        return self._load_user_entry(user_id)[0]
     
     def _save_user_history(self, user_id: str, history: List[Dict]) -> bool:
-        """Save user's analysis history."""
+        """Rewrite user's full analysis history; only needed when records are removed."""
         try:
             file_path = self._get_user_history_file(user_id)
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=2, ensure_ascii=False)
+            # Unique temp name so concurrent rewrites can't clobber each other's file
+            fd, tmp_path = tempfile.mkstemp(dir=self.storage_path, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(b"".join(_encode_record(record) for record in history))
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._cache_put(user_id, self._file_stamp(file_path), history)
             return True
         except Exception as e:
             logger.error(f"Error saving history for user {user_id}: {e}")
@@ -167,11 +311,8 @@ class AnalysisHistoryManager:
         try:
             history = self._load_user_history(user_id)
             
-            # Sort by timestamp (newest first)
-            history.sort(key=lambda x: x['timestamp'], reverse=True)
-            
-            # Apply limit
-            return history[:limit]
+            # Records are appended in timestamp order, so newest-first is a reversed tail
+            return history[-limit:][::-1] if limit > 0 else []
             
         except Exception as e:
             logger.error(f"Error getting analyses for user {user_id}: {e}")
@@ -180,13 +321,7 @@ class AnalysisHistoryManager:
     def get_analysis_by_id(self, user_id: str, analysis_id: str) -> Optional[Dict]:
         """Get a specific analysis by ID."""
         try:
-            history = self._load_user_history(user_id)
-            
-            for record in history:
-                if record['id'] == analysis_id:
-                    return record
-            
-            return None
+            return self._load_user_entry(user_id)[1].get(analysis_id)
             
         except Exception as e:
             logger.error(f"Error getting analysis {analysis_id} for user {user_id}: {e}")
@@ -202,22 +337,23 @@ class AnalysisHistoryManager:
         """
         try:
             retention_days = self.RETENTION_POLICIES.get(subscription_tier, 7)
-            cutoff_date = datetime.now() - timedelta(days=retention_days)
+            # ISO timestamps sort lexically, so compare strings instead of parsing each
+            cutoff_str = (datetime.now() - timedelta(days=retention_days)).isoformat(timespec='seconds')
             
-            history = self._load_user_history(user_id)
-            original_count = len(history)
-            
-            # Filter out expired analyses
-            valid_history = []
-            for record in history:
-                record_date = datetime.fromisoformat(record['timestamp'])
-                if record_date >= cutoff_date:
-                    valid_history.append(record)
+            # Held from load through rewrite so an append can't land in between and be lost
+            with self._append_lock:
+                history = self._load_user_history(user_id)
+                
+                # History is in timestamp order: expired records form a prefix
+                removed_count = next(
+                    (i for i, record in enumerate(history) if record['timestamp'] >= cutoff_str),
+                    len(history)
+                )
+                
+                # Save cleaned history only when something expired
+                if removed_count > 0:
+                    self._save_user_history(user_id, history[removed_count:])
             
-            # Save cleaned history
-            self._save_user_history(user_id, valid_history)
-            
-            removed_count = original_count - len(valid_history)
             if removed_count > 0:
                 logger.info(f"Cleaned up {removed_count} expired analyses for user {user_id}")
             
@@ -227,6 +363,50 @@ class AnalysisHistoryManager:
             logger.error(f"Error cleaning up analyses for user {user_id}: {e}")
             return 0
     
+    @log_performance
+    def cleanup_all_expired_analyses(self) -> int:
+        """
+        Clean up expired analyses for every user, using the subscription tier
+        recorded on each user's most recent analysis.
+        
+        Returns:
+            int: Number of analyses removed
+        """
+        prefix, suffix = "user_", "_history.jsonl"
+        longest_retention = max(self.RETENTION_POLICIES.values()) * 86400
+        now = time.time()
+        removed_count = 0
+        
+        with os.scandir(self.storage_path) as entries:
+            for entry in entries:
+                if not (entry.name.startswith(prefix) and entry.name.endswith(suffix)):
+                    continue
+                user_id = entry.name[len(prefix):-len(suffix)]
+                
+                try:
+                    # Untouched for longer than any retention window: every record has
+                    # expired, so drop the file without parsing it (re-checked under the
+                    # lock, since an append may have just touched it)
+                    if now - entry.stat(follow_symlinks=False).st_mtime > longest_retention:
+                        with self._append_lock:
+                            if now - os.stat(entry.path).st_mtime > longest_retention:
+                                with open(entry.path, 'rb') as f:
+                                    record_count = f.read().count(b"\n")
+                                os.remove(entry.path)
+                                with self._cache_lock:
+                                    self._cache.pop(user_id, None)
+                                removed_count += record_count
+                                continue
+                    
+                    history = self._load_user_history(user_id)
+                    if history:
+                        tier = history[-1].get('subscription_tier', 'free')
+                        removed_count += self.cleanup_expired_analyses(user_id, tier)
+                except OSError as e:
+                    logger.error(f"Error cleaning up history file {entry.name}: {e}")
+        
+        return removed_count
+    
     def get_analysis_stats(self, user_id: str) -> Dict[str, Any]:
         """Get analysis statistics for a user."""
         try:
@@ -240,17 +420,24 @@ class AnalysisHistoryManager:
                     'unique_files': 0
                 }
             
-            # Calculate statistics
+            # Calculate statistics in a single pass over the records
+            total_time = 0
+            most_recent = ''
+            seen_hashes = set()
+            for r in history:
+                total_time += r.get('execution_time', 0)
+                timestamp = r['timestamp']
+                if timestamp > most_recent:
+                    most_recent = timestamp
+                seen_hashes.add(r['file_hash'])
+            
             total_analyses = len(history)
-            avg_execution_time = sum(r.get('execution_time', 0) for r in history) / total_analyses
-            most_recent = max(history, key=lambda x: x['timestamp'])
-            unique_files = len(set(r['file_hash'] for r in history))
             
             return {
                 'total_analyses': total_analyses,
-                'avg_execution_time': round(avg_execution_time, 2),
-                'most_recent': most_recent['timestamp'],
-                'unique_files': unique_files
+                'avg_execution_time': round(total_time / total_analyses, 2),
+                'most_recent': most_recent,
+                'unique_files': len(seen_hashes)
             }
             
         except Exception as e:
@@ -1,20 +1,72 @@
+import asyncio
 import json
 import hashlib
+import mmap
 import pickle
-from typing import Any, Optional, Dict
-from datetime import datetime, timedelta
+import threading
+import time
+from typing import Any, Optional, Dict, List
 import os
 
 try:
     import redis
+    import redis.asyncio as aioredis
     REDIS_AVAILABLE = True
 except ImportError:
     REDIS_AVAILABLE = False
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from ..utils.logging_config import get_logger, log_performance
 
 logger = get_logger('csv_analyzer')
 
+# Redis payloads are tagged so JSON-safe dicts/lists can take the fast orjson
+# path while anything else keeps exact types through pickle
+_JSON_PREFIX = b'J'
+_PICKLE_PREFIX = b'P'
+
+# Upper bound on pooled Redis connections per process
+REDIS_MAX_CONNECTIONS = 64
+
+
+def stable_json_dumps(obj: Any) -> str:
+    """
+    Compact, key-sorted JSON for building cache keys. The stdlib fallback
+    produces the same text as orjson so every worker derives the same key.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def _serialize(data: Any) -> bytes:
+    """Encode a cache payload, preferring orjson for dicts and lists that survive it unchanged."""
+    if ORJSON_AVAILABLE and isinstance(data, (dict, list)):
+        try:
+            encoded = orjson.dumps(data)
+            # JSON turns NaN into null, tuples into lists and datetimes into
+            # strings; only keep it when decoding gives back an equal value
+            if orjson.loads(encoded) == data:
+                return _JSON_PREFIX + encoded
+        except (TypeError, ValueError):
+            pass  # e.g. non-str dict keys, numpy values; pickle preserves them
+    return _PICKLE_PREFIX + pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _deserialize(payload: bytes) -> Any:
+    """Decode a payload written by _serialize (or an untagged legacy pickle)."""
+    tag, body = payload[:1], memoryview(payload)[1:]
+    if tag == _JSON_PREFIX:
+        return orjson.loads(body) if ORJSON_AVAILABLE else json.loads(bytes(body))
+    if tag == _PICKLE_PREFIX:
+        return pickle.loads(body)
+    return pickle.loads(payload)
+
 class CacheManager:
     """
     Professional cache manager for CSV Analyzer Pro.
@@ -30,51 +82,93 @@ class CacheManager:
     
     def __init__(self):
         self.redis_client = None
+        self.async_client = None
         self.use_redis = False
+        self.cache_dir = "cache"
         
-        # Try to connect to Redis
-        if REDIS_AVAILABLE:
-            try:
-                redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
-                self.redis_client = redis.from_url(redis_url)
-                self.redis_client.ping()  # Test connection
-                self.use_redis = True
-                logger.info("Redis cache backend initialized successfully")
-            except Exception as e:
-                logger.warning(f"Redis connection failed, falling back to local cache: {e}")
+        # The backend is picked on first use, so importing this module never
+        # waits on a Redis connect
+        self._backend_ready = False
+        self._backend_lock = threading.Lock()
+    
+    def _ensure_backend(self) -> None:
+        """Connect to Redis, or fall back to the local file cache, once per process."""
+        if self._backend_ready:
+            return
         
-        # Fallback to local file cache
-        if not self.use_redis:
-            self.cache_dir = "cache"
-            os.makedirs(self.cache_dir, exist_ok=True)
-            logger.info("Local file cache backend initialized")
+        with self._backend_lock:
+            if self._backend_ready:
+                return
+            
+            # Try to connect to Redis
+            if REDIS_AVAILABLE:
+                try:
+                    redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
+                    # Shared pool so concurrent workers don't queue behind one socket;
+                    # redis-py parses replies with hiredis whenever it is installed
+                    pool = redis.BlockingConnectionPool.from_url(
+                        redis_url,
+                        max_connections=REDIS_MAX_CONNECTIONS,
+                        socket_connect_timeout=1,  # fail fast when Redis is down
+                        socket_keepalive=True,
+                        health_check_interval=30
+                    )
+                    self.redis_client = redis.Redis(connection_pool=pool)
+                    self.redis_client.ping()  # Test connection
+                    # Separate client for event-loop callers; connects on first await
+                    self.async_client = aioredis.from_url(
+                        redis_url,
+                        max_connections=REDIS_MAX_CONNECTIONS,
+                        socket_connect_timeout=1,
+                        socket_keepalive=True,
+                        health_check_interval=30
+                    )
+                    self.use_redis = True
+                    logger.info("Redis cache backend initialized successfully")
+                except Exception as e:
+                    logger.warning(f"Redis connection failed, falling back to local cache: {e}")
+            
+            # Fallback to local file cache
+            if not self.use_redis:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                logger.info("Local file cache backend initialized")
+            
+            self._backend_ready = True
     
     def _generate_key(self, query: str, file_hash: str = None) -> str:
         """Generate a unique cache key for a query."""
         key_data = f"{query}_{file_hash}" if file_hash else query
-        return hashlib.md5(key_data.encode()).hexdigest()
+        return hashlib.blake2b(key_data.encode(), digest_size=16).hexdigest()
     
     @log_performance
     def get(self, key: str) -> Optional[Any]:
         """Retrieve cached data."""
+        self._ensure_backend()
         try:
             if self.use_redis:
                 cached_data = self.redis_client.get(key)
                 if cached_data:
-                    return pickle.loads(cached_data)
+                    return _deserialize(cached_data)
             else:
                 cache_file = os.path.join(self.cache_dir, f"{key}.cache")
-                if os.path.exists(cache_file):
-                    with open(cache_file, 'rb') as f:
-                        cache_entry = pickle.load(f)
-                    
-                    # Check expiration
-                    if cache_entry['expires_at'] > datetime.now():
-                        logger.debug(f"Cache hit for key: {key}")
-                        return cache_entry['data']
-                    else:
+                try:
+                    stat = os.stat(cache_file)
+                except FileNotFoundError:
+                    stat = None
+                
+                if stat is not None and stat.st_size > 0:
+                    # The file's mtime holds its expiry, so expired entries are
+                    # dropped without being opened
+                    if stat.st_mtime <= time.time():
                         os.remove(cache_file)
                         logger.debug(f"Cache expired for key: {key}")
+                    else:
+                        # Unpickle straight from the page cache instead of copying through a read buffer
+                        with open(cache_file, 'rb') as f, \
+                                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            data = pickle.loads(mm)
+                        logger.debug(f"Cache hit for key: {key}")
+                        return data
             
             logger.debug(f"Cache miss for key: {key}")
             return None
@@ -86,21 +180,24 @@ class CacheManager:
     @log_performance
     def set(self, key: str, data: Any, ttl_seconds: int = 3600) -> bool:
         """Store data in cache with TTL."""
+        self._ensure_backend()
         try:
             if self.use_redis:
-                serialized_data = pickle.dumps(data)
+                serialized_data = _serialize(data)
                 self.redis_client.setex(key, ttl_seconds, serialized_data)
                 logger.debug(f"Cached data for key: {key} (TTL: {ttl_seconds}s)")
             else:
-                cache_entry = {
-                    'data': data,
-                    'created_at': datetime.now(),
-                    'expires_at': datetime.now() + timedelta(seconds=ttl_seconds)
-                }
-                
                 cache_file = os.path.join(self.cache_dir, f"{key}.cache")
-                with open(cache_file, 'wb') as f:
-                    pickle.dump(cache_entry, f)
+                # Replace atomically: truncating a file another reader has mapped
+                # would fault that reader
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+                with open(tmp_file, 'wb') as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                # Record the expiry as the mtime; entries from the old dict-wrapped
+                # format carry their write time and so read as expired
+                now = time.time()
+                os.utime(tmp_file, (now, now + ttl_seconds))
+                os.replace(tmp_file, cache_file)
                 
                 logger.debug(f"Cached data for key: {key} (TTL: {ttl_seconds}s)")
             
@@ -110,6 +207,108 @@ class CacheManager:
             logger.error(f"Cache storage error for key {key}: {e}")
             return False
     
+    @log_performance
+    def mget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Retrieve several cached values in one round-trip; misses come back as None."""
+        self._ensure_backend()
+        if not self.use_redis:
+            return [self.get(key) for key in keys]
+        
+        try:
+            cached_values = self.redis_client.mget(keys) if keys else []
+            return [_deserialize(value) if value else None for value in cached_values]
+            
+        except Exception as e:
+            logger.error(f"Cache batch retrieval error for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+    
+    @log_performance
+    def mset(self, items: Dict[str, Any], ttl_seconds: int = 3600) -> bool:
+        """Store several values with the same TTL in one round-trip."""
+        self._ensure_backend()
+        if not self.use_redis:
+            return all([self.set(key, data, ttl_seconds) for key, data in items.items()])
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, data in items.items():
+                pipe.setex(key, ttl_seconds, _serialize(data))
+            pipe.execute()
+            logger.debug(f"Cached {len(items)} keys (TTL: {ttl_seconds}s)")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Cache batch storage error for {len(items)} keys: {e}")
+            return False
+    
+    async def aget(self, key: str) -> Optional[Any]:
+        """Async get() for event-loop callers; the file cache runs in a worker thread."""
+        if not self._backend_ready:
+            await asyncio.to_thread(self._ensure_backend)
+        if not self.use_redis:
+            return await asyncio.to_thread(self.get, key)
+        
+        try:
+            cached_data = await self.async_client.get(key)
+            if cached_data:
+                return _deserialize(cached_data)
+            logger.debug(f"Cache miss for key: {key}")
+            return None
+            
+        except Exception as e:
+            logger.error(f"Cache retrieval error for key {key}: {e}")
+            return None
+    
+    async def aset(self, key: str, data: Any, ttl_seconds: int = 3600) -> bool:
+        """Async set() for event-loop callers."""
+        if not self._backend_ready:
+            await asyncio.to_thread(self._ensure_backend)
+        if not self.use_redis:
+            return await asyncio.to_thread(self.set, key, data, ttl_seconds)
+        
+        try:
+            await self.async_client.setex(key, ttl_seconds, _serialize(data))
+            logger.debug(f"Cached data for key: {key} (TTL: {ttl_seconds}s)")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Cache storage error for key {key}: {e}")
+            return False
+    
+    async def amget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Async mget(); misses come back as None."""
+        if not self._backend_ready:
+            await asyncio.to_thread(self._ensure_backend)
+        if not self.use_redis:
+            return await asyncio.to_thread(self.mget, keys)
+        
+        try:
+            cached_values = await self.async_client.mget(keys) if keys else []
+            return [_deserialize(value) if value else None for value in cached_values]
+            
+        except Exception as e:
+            logger.error(f"Cache batch retrieval error for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+    
+    async def amset(self, items: Dict[str, Any], ttl_seconds: int = 3600) -> bool:
+        """Async mset(): one pipelined round-trip for all items."""
+        if not self._backend_ready:
+            await asyncio.to_thread(self._ensure_backend)
+        if not self.use_redis:
+            return await asyncio.to_thread(self.mset, items, ttl_seconds)
+        
+        try:
+            async with self.async_client.pipeline(transaction=False) as pipe:
+                for key, data in items.items():
+                    pipe.setex(key, ttl_seconds, _serialize(data))
+                await pipe.execute()
+            logger.debug(f"Cached {len(items)} keys (TTL: {ttl_seconds}s)")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Cache batch storage error for {len(items)} keys: {e}")
+            return False
+    
     def cache_query_result(self, query: str, file_hash: str, result: Any, ttl_seconds: int = 1800) -> str:
         """Cache SQL query results."""
         key = f"query_{self._generate_key(query, file_hash)}"
@@ -123,19 +322,20 @@ class CacheManager:
     
     def cache_analysis_result(self, analysis_type: str, parameters: Dict, result: Any, ttl_seconds: int = 3600) -> str:
         """Cache complex analysis results."""
-        param_str = json.dumps(parameters, sort_keys=True)
+        param_str = stable_json_dumps(parameters)
         key = f"analysis_{analysis_type}_{self._generate_key(param_str)}"
         self.set(key, result, ttl_seconds)
         return key
     
     def get_cached_analysis_result(self, analysis_type: str, parameters: Dict) -> Optional[Any]:
         """Retrieve cached analysis results."""
-        param_str = json.dumps(parameters, sort_keys=True)
+        param_str = stable_json_dumps(parameters)
         key = f"analysis_{analysis_type}_{self._generate_key(param_str)}"
         return self.get(key)
     
     def clear_cache(self) -> bool:
         """Clear all cached data."""
+        self._ensure_backend()
         try:
             if self.use_redis:
                 self.redis_client.flushall()
@@ -155,6 +355,7 @@ class CacheManager:
     
     def get_cache_stats(self) -> Dict[str, Any]:
         """Get cache statistics."""
+        self._ensure_backend()
         try:
             if self.use_redis:
                 info = self.redis_client.info()
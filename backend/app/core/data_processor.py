@@ -1,16 +1,35 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from typing import Dict, List, Optional, Tuple, Any
 import hashlib
-import json
-from io import StringIO
+from io import BytesIO
 from datetime import datetime
 
-from app.core.cache_manager import cache_manager
+from app.core.cache_manager import cache_manager, stable_json_dumps
 from app.utils.logging_config import get_logger, log_performance
 
 logger = get_logger('csv_analyzer')
 
+# Leading rows whose Arrow buffers feed the dataframe cache hash
+DATA_HASH_SAMPLE_ROWS = 8
+
+# Values trial-parsed before attempting a full datetime conversion of a text column
+DATETIME_SAMPLE_SIZE = 50
+
+# Lower bounds of the correlation strength bands and their labels
+CORRELATION_STRENGTH_THRESHOLDS = np.array([0.3, 0.5, 0.7, 0.9])
+CORRELATION_STRENGTH_LABELS = np.array(['Very Weak', 'Weak', 'Moderate', 'Strong', 'Very Strong'])
+
+# Rows sampled from object columns when estimating memory usage of tall frames
+MEMORY_SAMPLE_ROWS = 10000
+
+# analyze_data_quality sections, each cached under its own key
+QUALITY_REPORT_SECTIONS = (
+    'dataset_info', 'missing_data', 'data_types', 'duplicates', 'statistics', 'recommendations'
+)
+
 class DataProcessor:
     """
     Advanced data processing capabilities for CSV Analyzer Pro.
@@ -31,19 +50,36 @@ class DataProcessor:
         """Generate a unique cache key for data operations."""
         key_parts = [data_hash, operation]
         if params:
-            key_parts.append(json.dumps(params, sort_keys=True))
-        return hashlib.md5("_".join(key_parts).encode()).hexdigest()
+            key_parts.append(stable_json_dumps(params))
+        return hashlib.blake2b("_".join(key_parts).encode(), digest_size=16).hexdigest()
     
     def _get_data_hash(self, df: pd.DataFrame) -> str:
         """Generate a hash for the dataframe to use in caching."""
-        # Use shape, column names, and first few rows for hash
-        hash_data = {
-            'shape': df.shape,
-            'columns': list(df.columns),
-            'dtypes': df.dtypes.to_dict(),
-            'sample': df.head(3).to_dict() if len(df) > 0 else {}
-        }
-        return hashlib.md5(json.dumps(hash_data, default=str, sort_keys=True).encode()).hexdigest()
+        # Use shape, column names/dtypes, and the raw Arrow buffers of the first
+        # rows - hashing buffers skips building and JSON-encoding Python objects
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr(df.shape).encode())
+        digest.update("\0".join(f"{col}:{dtype}" for col, dtype in df.dtypes.items()).encode())
+        
+        sample = df.head(DATA_HASH_SAMPLE_ROWS)
+        try:
+            table = pa.Table.from_pandas(sample, preserve_index=False)
+            # Arrow-backed columns come through as slices that still reference the
+            # whole column's buffers; take() compacts them to just the sampled rows
+            table = table.take(pa.array(np.arange(table.num_rows)))
+        except (pa.ArrowException, ValueError, TypeError):
+            # Mixed-type object columns have no Arrow type; hash their text instead
+            digest.update(sample.to_csv(index=False).encode())
+            return digest.hexdigest()
+        
+        for column in table.columns:
+            for chunk in column.chunks:
+                if pa.types.is_dictionary(chunk.type):
+                    chunk = chunk.dictionary_decode()
+                for buffer in chunk.buffers():
+                    if buffer is not None:
+                        digest.update(buffer)
+        return digest.hexdigest()
     
     @log_performance
     def analyze_data_quality(self, df: pd.DataFrame) -> Dict[str, Any]:
@@ -57,35 +93,72 @@ class DataProcessor:
         - Statistical summaries
         """
         data_hash = self._get_data_hash(df)
-        cache_key = self._generate_cache_key(data_hash, "data_quality")
+        cache_keys = {
+            section: self._generate_cache_key(data_hash, f"data_quality_{section}")
+            for section in QUALITY_REPORT_SECTIONS
+        }
         
-        # Check cache first
+        # Check cache first; sections are cached separately so a partial hit
+        # only recomputes what is missing
+        cached_sections = {}
         if self.cache_enabled:
-            cached_result = cache_manager.get(cache_key)
-            if cached_result:
+            cached_values = cache_manager.mget(list(cache_keys.values()))
+            cached_sections = {
+                section: value
+                for section, value in zip(QUALITY_REPORT_SECTIONS, cached_values)
+                if value is not None
+            }
+            if len(cached_sections) == len(QUALITY_REPORT_SECTIONS):
                 logger.info("Data quality analysis retrieved from cache")
-                return cached_result
+                return cached_sections
         
         logger.info(f"Performing data quality analysis on dataset: {df.shape}")
         
         try:
-            quality_report = {
-                'dataset_info': {
+            if cached_sections:
+                # Helpers compute their own aggregates for the few sections rebuilt
+                column_missing = unique_counts = memory_bytes = None
+            else:
+                # Per-column aggregates shared by the sub-analyses, so each scan of
+                # the frame happens once instead of once per consumer
+                column_missing = df.isnull().sum()
+                unique_counts = df.nunique()
+                memory_bytes = self._estimate_memory_bytes(df)
+            
+            computed = {}
+            
+            def section(name, build):
+                if name not in cached_sections:
+                    computed[name] = build()
+                return cached_sections.get(name, computed.get(name))
+            
+            def dataset_info():
+                usage = memory_bytes if memory_bytes is not None else self._estimate_memory_bytes(df)
+                return {
                     'rows': len(df),
                     'columns': len(df.columns),
                     'total_cells': len(df) * len(df.columns),
-                    'memory_usage_mb': df.memory_usage(deep=True).sum() / 1024 / 1024
-                },
-                'missing_data': self._analyze_missing_data(df),
-                'data_types': self._analyze_data_types(df),
-                'duplicates': self._analyze_duplicates(df),
-                'statistics': self._generate_statistics(df),
-                'recommendations': self._generate_recommendations(df)
+                    'memory_usage_mb': usage / 1024 / 1024
+                }
+            
+            missing_data = section('missing_data', lambda: self._analyze_missing_data(df, column_missing))
+            data_types = section('data_types', lambda: self._analyze_data_types(df, unique_counts))
+            duplicates = section('duplicates', lambda: self._analyze_duplicates(df, column_missing, unique_counts))
+            
+            quality_report = {
+                'dataset_info': section('dataset_info', dataset_info),
+                'missing_data': missing_data,
+                'data_types': data_types,
+                'duplicates': duplicates,
+                'statistics': section('statistics', lambda: self._generate_statistics(df, column_missing, unique_counts)),
+                'recommendations': section('recommendations', lambda: self._generate_recommendations(
+                    df, missing_data, duplicates, data_types, memory_bytes
+                ))
             }
             
-            # Cache the result
-            if self.cache_enabled:
-                cache_manager.set(cache_key, quality_report, expire_time=3600)  # 1 hour
+            # Cache the recomputed sections in one round-trip
+            if self.cache_enabled and computed:
+                cache_manager.mset({cache_keys[name]: value for name, value in computed.items()}, ttl_seconds=3600)  # 1 hour
             
             logger.info("Data quality analysis completed successfully")
             return quality_report
@@ -94,46 +167,67 @@ class DataProcessor:
             logger.error(f"Error in data quality analysis: {e}")
             raise
     
-    def _analyze_missing_data(self, df: pd.DataFrame) -> Dict[str, Any]:
+    @staticmethod
+    def _estimate_memory_bytes(df: pd.DataFrame) -> int:
+        """
+        Deep memory usage of the frame. On tall frames the per-value walk over
+        object columns is extrapolated from evenly spaced sample rows.
+        """
+        object_cols = df.select_dtypes(include=['object']).columns
+        if len(df) <= MEMORY_SAMPLE_ROWS or len(object_cols) == 0:
+            return int(df.memory_usage(deep=True).sum())
+        
+        # Every other dtype reports its deep size without touching each value
+        exact_bytes = df.drop(columns=object_cols).memory_usage(deep=True).sum()
+        step = len(df) // MEMORY_SAMPLE_ROWS
+        sample = df[object_cols].iloc[::step]
+        sampled_bytes = sample.memory_usage(deep=True, index=False).sum()
+        return int(exact_bytes + sampled_bytes * len(df) / len(sample))
+    
+    def _analyze_missing_data(self, df: pd.DataFrame,
+                              column_missing: Optional[pd.Series] = None) -> Dict[str, Any]:
         """Analyze missing data patterns."""
         missing_info = {}
         total_cells = len(df) * len(df.columns)
         
+        # Per column counts in one vectorized pass; the overall total derives from them
+        if column_missing is None:
+            column_missing = df.isnull().sum()
+        column_pct = (column_missing / len(df) * 100).round(2)
+        
         # Overall missing data
-        total_missing = df.isnull().sum().sum()
-        missing_info['total_missing'] = int(total_missing)
+        total_missing = int(column_missing.sum())
+        missing_info['total_missing'] = total_missing
         missing_info['missing_percentage'] = round((total_missing / total_cells) * 100, 2)
         
         # Per column analysis
-        column_missing = df.isnull().sum()
-        missing_info['by_column'] = {}
-        
-        for col in df.columns:
-            missing_count = int(column_missing[col])
-            missing_pct = round((missing_count / len(df)) * 100, 2)
-            missing_info['by_column'][col] = {
-                'count': missing_count,
-                'percentage': missing_pct
-            }
+        missing_info['by_column'] = {
+            col: {'count': count, 'percentage': pct}
+            for col, count, pct in zip(df.columns, column_missing.tolist(), column_pct.tolist())
+        }
         
         # Identify problematic columns (>50% missing)
-        problematic_cols = [col for col, info in missing_info['by_column'].items() 
-                          if info['percentage'] > 50]
-        missing_info['problematic_columns'] = problematic_cols
+        missing_info['problematic_columns'] = column_pct.index[column_pct > 50].tolist()
         
         return missing_info
     
-    def _analyze_data_types(self, df: pd.DataFrame) -> Dict[str, Any]:
+    def _analyze_data_types(self, df: pd.DataFrame,
+                            unique_counts: Optional[pd.Series] = None) -> Dict[str, Any]:
         """Analyze and recommend data type optimizations."""
         type_info = {}
         
-        for col in df.columns:
-            current_dtype = str(df[col].dtype)
+        # Distinct counts for every column in one call instead of two nunique() per column
+        if unique_counts is None:
+            unique_counts = df.nunique()
+        unique_pct = (unique_counts / len(df) * 100).round(2)
+        
+        for col, dtype, unique_values, unique_percentage in zip(
+                df.columns, df.dtypes, unique_counts.tolist(), unique_pct.tolist()):
             type_info[col] = {
-                'current_type': current_dtype,
+                'current_type': str(dtype),
                 'recommended_type': self._recommend_data_type(df[col]),
-                'unique_values': int(df[col].nunique()),
-                'unique_percentage': round((df[col].nunique() / len(df)) * 100, 2)
+                'unique_values': unique_values,
+                'unique_percentage': unique_percentage
             }
         
         return type_info
@@ -142,20 +236,20 @@ class DataProcessor:
         """Recommend optimal data type for a series."""
         if series.dtype == 'object':
             # Try to convert to numeric
-            try:
-                pd.to_numeric(series, errors='raise')
+            if self._converts_fully(pd.to_numeric, series):
                 return 'numeric (int/float)'
-            except:
-                # Try to convert to datetime
-                try:
-                    pd.to_datetime(series, errors='raise')
-                    return 'datetime'
-                except:
-                    # Check if it's categorical
-                    unique_ratio = series.nunique() / len(series)
-                    if unique_ratio < 0.1:  # Less than 10% unique values
-                        return 'category'
-                    return 'text'
+            
+            # Try to convert to datetime; any sample value failing means the
+            # whole column would, so most text skips the full parse
+            sample = series.dropna().head(DATETIME_SAMPLE_SIZE)
+            if self._converts_fully(pd.to_datetime, sample) and self._converts_fully(pd.to_datetime, series):
+                return 'datetime'
+            
+            # Check if it's categorical
+            unique_ratio = series.nunique() / len(series)
+            if unique_ratio < 0.1:  # Less than 10% unique values
+                return 'category'
+            return 'text'
         
         elif series.dtype in ['int64', 'float64']:
             # Check if we can downcast
@@ -172,10 +266,20 @@ class DataProcessor:
         
         return str(series.dtype)
     
-    def _analyze_duplicates(self, df: pd.DataFrame) -> Dict[str, Any]:
+    @staticmethod
+    def _converts_fully(converter, series: pd.Series) -> bool:
+        """Whether every non-null value survives conversion, without raising on failures."""
+        try:
+            return converter(series, errors='coerce').notna().sum() == series.notna().sum()
+        except (TypeError, ValueError, OverflowError):
+            return False
+    
+    def _analyze_duplicates(self, df: pd.DataFrame, column_missing: Optional[pd.Series] = None,
+                            unique_counts: Optional[pd.Series] = None) -> Dict[str, Any]:
         """Analyze duplicate records."""
-        # Full row duplicates
-        duplicate_rows = df.duplicated().sum()
+        # Full row duplicates, counted from one 64-bit hash per row
+        row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        duplicate_rows = len(df) - len(pd.unique(row_hashes))
         
         # Partial duplicates (by key columns if identifiable)
         duplicate_info = {
@@ -184,33 +288,48 @@ class DataProcessor:
             'unique_rows': int(len(df) - duplicate_rows)
         }
         
-        # Identify potential ID columns
-        potential_ids = []
-        for col in df.columns:
-            if df[col].nunique() == len(df) and not df[col].isnull().any():
-                potential_ids.append(col)
+        # Identify potential ID columns: every value present and distinct
+        if column_missing is None:
+            column_missing = df.isnull().sum()
+        if unique_counts is None:
+            unique_counts = df.nunique()
+        potential_ids = [col for col in df.columns
+                         if unique_counts[col] == len(df) and column_missing[col] == 0]
         
         duplicate_info['potential_id_columns'] = potential_ids
         
         return duplicate_info
     
-    def _generate_statistics(self, df: pd.DataFrame) -> Dict[str, Any]:
+    def _generate_statistics(self, df: pd.DataFrame, column_missing: Optional[pd.Series] = None,
+                             unique_counts: Optional[pd.Series] = None) -> Dict[str, Any]:
         """Generate comprehensive statistical summary."""
         stats = {}
+        if column_missing is None:
+            column_missing = df.isnull().sum()
+        if unique_counts is None:
+            unique_counts = df.nunique()
         
         # Numeric columns
         numeric_cols = df.select_dtypes(include=[np.number]).columns
         if len(numeric_cols) > 0:
             stats['numeric'] = {}
+            # One reduction per statistic across all numeric columns, rather
+            # than five pandas calls per column
+            numeric_df = df[numeric_cols]
+            summary = {
+                'mean': numeric_df.mean(),
+                'median': numeric_df.median(),
+                'std': numeric_df.std(),
+                'min': numeric_df.min(),
+                'max': numeric_df.max()
+            }
             for col in numeric_cols:
+                all_missing = column_missing[col] == len(df)
                 col_stats = {
-                    'mean': float(df[col].mean()) if not df[col].isnull().all() else None,
-                    'median': float(df[col].median()) if not df[col].isnull().all() else None,
-                    'std': float(df[col].std()) if not df[col].isnull().all() else None,
-                    'min': float(df[col].min()) if not df[col].isnull().all() else None,
-                    'max': float(df[col].max()) if not df[col].isnull().all() else None,
-                    'outliers': self._detect_outliers(df[col])
+                    name: float(values[col]) if not all_missing else None
+                    for name, values in summary.items()
                 }
+                col_stats['outliers'] = self._detect_outliers(df[col])
                 stats['numeric'][col] = col_stats
         
         # Categorical columns
@@ -220,7 +339,7 @@ class DataProcessor:
             for col in categorical_cols:
                 top_values = df[col].value_counts().head(5).to_dict()
                 stats['categorical'][col] = {
-                    'unique_count': int(df[col].nunique()),
+                    'unique_count': int(unique_counts[col]),
                     'most_frequent': top_values
                 }
         
@@ -228,40 +347,69 @@ class DataProcessor:
     
     def _detect_outliers(self, series: pd.Series) -> Dict[str, Any]:
         """Detect outliers using IQR method."""
-        if series.dtype not in [np.number] or series.isnull().all():
+        if (not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series)
+                or series.isnull().all()):
             return {'count': 0, 'percentage': 0.0}
         
-        Q1 = series.quantile(0.25)
-        Q3 = series.quantile(0.75)
+        # Both quartiles from one partition over a float64 array, then a single mask
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[~np.isnan(values)]
+        Q1, Q3 = self._quartiles(values)
         IQR = Q3 - Q1
         
         lower_bound = Q1 - 1.5 * IQR
         upper_bound = Q3 + 1.5 * IQR
         
-        outliers = series[(series < lower_bound) | (series > upper_bound)]
+        outlier_count = int(np.count_nonzero((values < lower_bound) | (values > upper_bound)))
         
         return {
-            'count': len(outliers),
-            'percentage': round((len(outliers) / len(series)) * 100, 2),
+            'count': outlier_count,
+            'percentage': round((outlier_count / len(series)) * 100, 2),
             'bounds': {'lower': float(lower_bound), 'upper': float(upper_bound)}
         }
     
-    def _generate_recommendations(self, df: pd.DataFrame) -> List[str]:
-        """Generate data quality recommendations."""
+    @staticmethod
+    def _quartiles(values: np.ndarray) -> Tuple[float, float]:
+        """
+        25th and 75th percentiles of a NaN-free array with numpy's default linear
+        interpolation, selected by one O(n) partition instead of a sort.
+        """
+        last = values.size - 1
+        positions = np.array([0.25, 0.75]) * last
+        lower = np.floor(positions).astype(np.intp)
+        upper = np.minimum(lower + 1, last)
+        selected = np.partition(values, np.union1d(lower, upper))
+        below, above = selected[lower], selected[upper]
+        
+        # Same lerp as np.percentile, so results match it bit for bit
+        fraction = positions - lower
+        spread = above - below
+        quartiles = np.where(fraction >= 0.5, above - spread * (1 - fraction), below + spread * fraction)
+        return float(quartiles[0]), float(quartiles[1])
+    
+    def _generate_recommendations(self, df: pd.DataFrame,
+                                  missing_data: Optional[Dict[str, Any]] = None,
+                                  duplicate_data: Optional[Dict[str, Any]] = None,
+                                  type_data: Optional[Dict[str, Any]] = None,
+                                  memory_bytes: Optional[int] = None) -> List[str]:
+        """Generate data quality recommendations, reusing any sub-analyses already computed."""
         recommendations = []
         
         # Missing data recommendations
-        missing_data = self._analyze_missing_data(df)
+        if missing_data is None:
+            missing_data = self._analyze_missing_data(df)
         if missing_data['missing_percentage'] > 10:
             recommendations.append(f"High missing data detected ({missing_data['missing_percentage']:.1f}%). Consider data imputation strategies.")
         
         # Duplicate recommendations
-        duplicate_data = self._analyze_duplicates(df)
+        if duplicate_data is None:
+            duplicate_data = self._analyze_duplicates(df)
         if duplicate_data['duplicate_percentage'] > 5:
             recommendations.append(f"Significant duplicates found ({duplicate_data['duplicate_percentage']:.1f}%). Consider deduplication.")
         
         # Data type recommendations
-        type_data = self._analyze_data_types(df)
+        if type_data is None:
+            type_data = self._analyze_data_types(df)
         memory_optimization = False
         for col, info in type_data.items():
             if info['current_type'] != info['recommended_type']:
@@ -272,7 +420,9 @@ class DataProcessor:
             recommendations.append("Data type optimization opportunities detected. Consider converting to more efficient types.")
         
         # Size recommendations
-        memory_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+        if memory_bytes is None:
+            memory_bytes = self._estimate_memory_bytes(df)
+        memory_mb = memory_bytes / 1024 / 1024
         if memory_mb > 100:
             recommendations.append(f"Large dataset detected ({memory_mb:.1f}MB). Consider data sampling for faster analysis.")
         
@@ -314,21 +464,25 @@ class DataProcessor:
                 }
             
             # Calculate correlation matrix
-            corr_matrix = numeric_df.corr()
+            corr_matrix = self._correlation_matrix(numeric_df)
             
-            # Find strong correlations
-            strong_correlations = []
-            for i, col1 in enumerate(corr_matrix.columns):
-                for j, col2 in enumerate(corr_matrix.columns):
-                    if i < j:  # Avoid duplicates and self-correlation
-                        corr_value = corr_matrix.loc[col1, col2]
-                        if abs(corr_value) >= threshold and not np.isnan(corr_value):
-                            strong_correlations.append({
-                                'variable1': col1,
-                                'variable2': col2,
-                                'correlation': round(float(corr_value), 3),
-                                'strength': self._interpret_correlation_strength(abs(corr_value))
-                            })
+            # Find strong correlations in the upper triangle (no duplicates or self-correlation)
+            corr_values = corr_matrix.to_numpy()
+            upper_i, upper_j = np.triu_indices_from(corr_values, k=1)
+            pair_values = corr_values[upper_i, upper_j]
+            strong = np.abs(pair_values) >= threshold  # NaN compares False
+            strong_values = pair_values[strong]
+            strengths = self._correlation_strength_labels(np.abs(strong_values))
+            columns = corr_matrix.columns
+            strong_correlations = [
+                {
+                    'variable1': columns[i],
+                    'variable2': columns[j],
+                    'correlation': round(float(corr_value), 3),
+                    'strength': strength
+                }
+                for i, j, corr_value, strength in zip(upper_i[strong], upper_j[strong], strong_values, strengths)
+            ]
             
             # Sort by absolute correlation value
             strong_correlations.sort(key=lambda x: abs(x['correlation']), reverse=True)
@@ -342,7 +496,7 @@ class DataProcessor:
             
             # Cache the result
             if self.cache_enabled:
-                cache_manager.set(cache_key, result, expire_time=3600)
+                cache_manager.set(cache_key, result, ttl_seconds=3600)
             
             logger.info(f"Found {len(strong_correlations)} strong correlations")
             return result
@@ -351,18 +505,32 @@ class DataProcessor:
             logger.error(f"Error in correlation analysis: {e}")
             raise
     
+    @staticmethod
+    def _correlation_matrix(numeric_df: pd.DataFrame) -> pd.DataFrame:
+        """Pearson correlation matrix with the O(rows x cols²) product done in float32."""
+        values = numeric_df.to_numpy(dtype=np.float64, na_value=np.nan)
+        if len(values) < 2 or np.isnan(values).any():
+            # Pairwise-complete correlations need pandas' NaN handling
+            return numeric_df.corr()
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Standardize in float64 first so large-offset columns (ids, epochs)
+            # keep their precision; constant columns become NaN as in .corr()
+            standardized = ((values - values.mean(axis=0)) / values.std(axis=0, ddof=1)).astype(np.float32)
+            matrix = (standardized.T @ standardized) / (len(values) - 1)
+        return pd.DataFrame(matrix.astype(np.float64), index=numeric_df.columns, columns=numeric_df.columns)
+    
     def _interpret_correlation_strength(self, abs_corr: float) -> str:
         """Interpret correlation strength."""
-        if abs_corr >= 0.9:
-            return "Very Strong"
-        elif abs_corr >= 0.7:
-            return "Strong"
-        elif abs_corr >= 0.5:
-            return "Moderate"
-        elif abs_corr >= 0.3:
-            return "Weak"
-        else:
-            return "Very Weak"
+        return self._correlation_strength_labels(np.array([abs_corr]))[0]
+    
+    @staticmethod
+    def _correlation_strength_labels(abs_corrs: np.ndarray) -> List[str]:
+        """Strength labels for a vector of absolute correlations in one searchsorted."""
+        # side='right' puts values equal to a threshold in the band above it
+        return CORRELATION_STRENGTH_LABELS[
+            np.searchsorted(CORRELATION_STRENGTH_THRESHOLDS, abs_corrs, side='right')
+        ].tolist()
 
 # Global data processor instance
 data_processor = DataProcessor()
@@ -379,6 +547,16 @@ def get_data_preview(upload_file, samples_rows: int = 1000) -> pd.DataFrame:
     Returns:
     - A DataFrame containing the preview of the data.
     """
-    string_io = StringIO(upload_file.getvalue().decode("utf-8"))
-    preview_df = pd.read_csv(string_io, nrows=samples_rows)
+    # Stream record batches from Arrow's native parser and stop once the
+    # preview is filled, rather than decoding the whole upload to text
+    reader = pacsv.open_csv(BytesIO(upload_file.getvalue()))
+    batches = []
+    rows = 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= samples_rows:
+            break
+    preview_table = pa.Table.from_batches(batches, schema=reader.schema)
+    preview_df = preview_table.slice(0, samples_rows).to_pandas()
     return preview_df
\ No newline at end of file
@@ -6,8 +6,11 @@ solution using the Supabase PostgreSQL database. It manages user profiles,
 subscription tiers, and usage statistics.
 """
 
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 from enum import Enum
 
 from app.utils.logging_config import get_logger, log_performance
@@ -15,6 +18,11 @@ from app.auth.supabase_client import supabase_client
 
 logger = get_logger('csv_analyzer')
 
+# Upgrades are idempotent, so a repeat for the same (email, tier) within this
+# many seconds (e.g. an admin logging in again) is skipped
+UPGRADE_CACHE_TTL = 300
+_UPGRADE_CACHE: Dict[Tuple[str, str], float] = {}
+
 class SubscriptionTier(Enum):
     FREE = "free"
     PRO = "pro"
@@ -41,29 +49,91 @@ class UsageLimits:
             "max_file_size_mb": 1000,  # 1GB limit for admin
         }
     }
+    # Keyed by the tier strings stored on profiles, so permission checks are a
+    # single dict lookup without constructing the enum
+    TIER_LIMITS_BY_STR = {tier.value: limits for tier, limits in TIER_LIMITS.items()}
+    DEFAULT = TIER_LIMITS_BY_STR[SubscriptionTier.FREE.value]
+
+# Daily analysis limit per tier value, passed to the try_record_analysis
+# Postgres function so the limits stay defined here
+DAILY_LIMITS_BY_TIER = {
+    tier: limits["daily_analyses"] for tier, limits in UsageLimits.TIER_LIMITS_BY_STR.items()
+}
+
+# Profile fields the usage checks read; the hot-path select fetches only these
+PROFILE_COLUMNS = "id,subscription_tier,subscription_status,daily_analyses,last_analysis_date,total_analyses"
+
+
+# Fixed fields of the test-mode profile; id and last_analysis_date are filled per call
+_TEST_PROFILE_TEMPLATE = {
+    'id': None,
+    'subscription_tier': SubscriptionTier.FREE.value,
+    'subscription_status': 'active',
+    'daily_analyses': 0,
+    'last_analysis_date': None,
+    'total_analyses': 0,
+    'stripe_customer_id': None,
+    'stripe_subscription_id': None
+}
+
+
+def _today_iso() -> str:
+    """Today's date as Postgres current_date sees it (Supabase databases run in UTC)."""
+    return datetime.now(timezone.utc).date().isoformat()
 
 class DBUsageTracker:
     """
     Manages user usage and subscriptions using a Supabase database backend.
     """
     
+    # Profiles are served from memory for this many seconds, so the several
+    # lookups one page render makes cost a single round-trip
+    PROFILE_CACHE_TTL = 30
+    PROFILE_CACHE_SIZE = 10000
+    
+    def __init__(self):
+        # user_id -> (fetched_at, profile), least recently used first
+        self._profile_cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._profile_cache_lock = threading.RLock()
+        # Cleared if the record_analysis / try_record_analysis Postgres
+        # functions turn out to be missing
+        self._record_rpc_available = True
+        self._check_rpc_available = True
+        self._refund_rpc_available = True
+    
+    def _cached_profile(self, user_id: str) -> Optional[Dict]:
+        """Return the cached profile if it is younger than PROFILE_CACHE_TTL."""
+        with self._profile_cache_lock:
+            cached = self._profile_cache.get(user_id)
+            if cached is None:
+                return None
+            if time.monotonic() - cached[0] >= self.PROFILE_CACHE_TTL:
+                del self._profile_cache[user_id]
+                return None
+            self._profile_cache.move_to_end(user_id)
+            return cached[1]
+    
+    def _cache_profile(self, profile: Dict) -> None:
+        """Cache a full profile row, e.g. one returned by a select, insert or update."""
+        with self._profile_cache_lock:
+            self._profile_cache[profile['id']] = (time.monotonic(), profile)
+            self._profile_cache.move_to_end(profile['id'])
+            while len(self._profile_cache) > self.PROFILE_CACHE_SIZE:
+                self._profile_cache.popitem(last=False)
+    
+    def _invalidate_profile(self, user_id: str) -> None:
+        """Drop a user's cached profile ahead of a write to it."""
+        with self._profile_cache_lock:
+            self._profile_cache.pop(user_id, None)
+    
     def _is_test_mode(self) -> bool:
         """Check if we're running in test mode (no Supabase connection or fallback mode)"""
         import os
-        return supabase_client is None or os.environ.get('FALLBACK_TO_TEST_USER', 'false').lower() == 'true'
+        return supabase_client() is None or os.environ.get('FALLBACK_TO_TEST_USER', 'false').lower() == 'true'
     
     def _get_test_profile(self, user_id: str) -> Dict:
         """Return a test profile for test mode"""
-        return {
-            'id': user_id,
-            'subscription_tier': SubscriptionTier.FREE.value,
-            'subscription_status': 'active',
-            'daily_analyses': 0,  # Changed from daily_analysis_count to match expected key
-            'last_analysis_date': datetime.now().date().isoformat(),  # Changed from daily_analysis_date
-            'total_analyses': 0,  # Added this key
-            'stripe_customer_id': None,
-            'stripe_subscription_id': None
-        }
+        return {**_TEST_PROFILE_TEMPLATE, 'id': user_id, 'last_analysis_date': _today_iso()}
 
     @log_performance
     def _get_or_create_user_profile(self, user_id: str) -> Optional[Dict]:
@@ -76,24 +146,32 @@ class DBUsageTracker:
             logger.info("Running in test mode or using fallback user - returning mock profile")
             return self._get_test_profile(user_id)
             
+        profile = self._cached_profile(user_id)
+        if profile is not None:
+            return profile
+            
         try:
             # First, try to select the profile
-            response = supabase_client.table("profiles").select("*").eq("id", user_id).execute()
+            # maybe_single() returns the row itself; newer clients return no
+            # response at all when the row is missing
+            response = supabase_client().table("profiles").select(PROFILE_COLUMNS).eq("id", user_id).maybe_single().execute()
             
-            if response.data:
-                return response.data[0]
+            if response and response.data:
+                self._cache_profile(response.data)
+                return response.data
 
             # If no profile, it might be a new user from Auth.
             # The profile is usually created by a trigger on the `auth.users` table.
             # We can insert a basic profile if it's missing.
             logger.info(f"No profile found for user_id {user_id}. Creating one.")
-            insert_response = supabase_client.table("profiles").insert({
+            insert_response = supabase_client().table("profiles").insert({
                 "id": user_id,
                 "subscription_tier": SubscriptionTier.FREE.value,
                 "subscription_status": "active"
             }).execute()
 
             if insert_response.data:
+                self._cache_profile(insert_response.data[0])
                 return insert_response.data[0]
             else:
                 logger.error(f"Failed to create profile for user {user_id}: {insert_response.error}")
@@ -110,17 +188,17 @@ class DBUsageTracker:
         if not profile:
             return False, "Could not retrieve user profile.", {}
 
-        tier = SubscriptionTier(profile.get("subscription_tier", "free"))
-        limits = UsageLimits.TIER_LIMITS[tier]
+        limits = UsageLimits.TIER_LIMITS_BY_STR.get(profile.get("subscription_tier", "free"), UsageLimits.DEFAULT)
+
+        today_str = _today_iso()
 
         # Pro/Enterprise users have unlimited analyses
         if limits["daily_analyses"] < 0:
-            return True, "Analysis allowed", self._get_usage_info(profile)
+            return True, "Analysis allowed", self._get_usage_info(profile, today_str=today_str)
 
         # Check daily usage for free users
         last_analysis_str = profile.get("last_analysis_date")
         daily_analyses = profile.get("daily_analyses", 0)
-        today_str = datetime.now().date().isoformat()
 
         # Reset daily count if it's a new day
         if last_analysis_str != today_str:
@@ -128,23 +206,59 @@ class DBUsageTracker:
 
         if daily_analyses >= limits["daily_analyses"]:
             reason = f"Daily limit of {limits['daily_analyses']} analysis reached for Free plan."
-            return False, reason, self._get_usage_info(profile, daily_analyses)
+            return False, reason, self._get_usage_info(profile, daily_analyses, today_str)
 
-        return True, "Analysis allowed", self._get_usage_info(profile, daily_analyses)
+        return True, "Analysis allowed", self._get_usage_info(profile, daily_analyses, today_str)
 
     @log_performance
     def record_analysis(self, user_id: str, analysis_type: str = "general") -> Dict:
-        """Records a completed analysis and updates usage stats in the database."""
+        """
+        Records a completed analysis and updates usage stats in the database.
+
+        The increment and daily reset run server-side in one round-trip through
+        this Postgres function:
+
+            create or replace function record_analysis(uid uuid)
+            returns setof profiles language sql as $$
+                update profiles set
+                    daily_analyses = case when last_analysis_date = current_date
+                                          then coalesce(daily_analyses, 0) + 1 else 1 end,
+                    total_analyses = coalesce(total_analyses, 0) + 1,
+                    last_analysis_date = current_date
+                where id = uid
+                returning *;
+            $$;
+
+        Until it is deployed, or when the profile does not exist yet, the
+        select-then-update path below is used; it writes the UTC date so both
+        paths agree with current_date.
+        """
         if self._is_test_mode():
             logger.info("Running in test mode - skipping analysis recording")
             return self._get_test_profile(user_id)
+        
+        if self._record_rpc_available:
+            self._invalidate_profile(user_id)
+            try:
+                response = supabase_client().rpc("record_analysis", {"uid": user_id}).execute()
+                if response.data:
+                    logger.info(f"Analysis recorded for user {user_id}: {analysis_type}")
+                    updated_profile = response.data[0]
+                    self._cache_profile(updated_profile)
+                    return self._get_usage_info(updated_profile)
+            except Exception as e:
+                if getattr(e, "code", None) != "PGRST202":  # PostgREST: function not found
+                    logger.error(f"DB error recording analysis for user {user_id}: {e}")
+                    return {}
+                logger.warning("record_analysis function not deployed; using select-then-update")
+                self._record_rpc_available = False
             
         profile = self._get_or_create_user_profile(user_id)
         if not profile:
             logger.error(f"Cannot record analysis, user profile not found for {user_id}")
             return {}
 
-        today_str = datetime.now().date().isoformat()
+        today_str = _today_iso()
         daily_analyses = profile.get("daily_analyses", 0)
 
         # Reset daily count if it's a new day
@@ -157,13 +271,16 @@ class DBUsageTracker:
             "last_analysis_date": today_str
         }
 
+        # Drop the cached copy up front so a failed write can't leave it stale
+        self._invalidate_profile(user_id)
         try:
-            response = supabase_client.table("profiles").update(update_data).eq("id", user_id).execute()
+            response = supabase_client().table("profiles").update(update_data).eq("id", user_id).execute()
             if response.data:
                 logger.info(f"Analysis recorded for user {user_id}: {analysis_type}")
                 # Return updated info
                 updated_profile = response.data[0]
-                return self._get_usage_info(updated_profile)
+                self._cache_profile(updated_profile)
+                return self._get_usage_info(updated_profile, today_str=today_str)
             else:
                 logger.error(f"Failed to record analysis for user {user_id}: {response.error}")
                 return {}
@@ -171,15 +288,154 @@ class DBUsageTracker:
             logger.error(f"DB error recording analysis for user {user_id}: {e}")
             return {}
 
-    def _get_usage_info(self, profile: Dict, current_daily_count: Optional[int] = None) -> Dict:
-        """Helper to construct the usage info dictionary."""
-        tier = SubscriptionTier(profile.get("subscription_tier", "free"))
-        limits = UsageLimits.TIER_LIMITS[tier]
+    @log_performance
+    def check_and_record(self, user_id: str, analysis_type: str = "general") -> Tuple[bool, str, Dict]:
+        """
+        Checks the daily limit and records the analysis in one atomic step, so
+        concurrent sessions cannot both pass the check. Returns the same
+        (allowed, reason, usage_info) triple as can_perform_analysis.
+
+        Runs server-side through this Postgres function:
+
+            create or replace function try_record_analysis(uid uuid, daily_limits jsonb)
+            returns jsonb language plpgsql as $$
+            declare
+                p profiles;
+                used int;
+                lim int;
+            begin
+                select * into p from profiles where id = uid for update;
+                if not found then
+                    return null;
+                end if;
+                used := case when p.last_analysis_date = current_date
+                             then coalesce(p.daily_analyses, 0) else 0 end;
+                lim := coalesce((daily_limits ->> p.subscription_tier)::int,
+                                (daily_limits ->> 'free')::int);
+                if lim >= 0 and used >= lim then
+                    return jsonb_build_object('allowed', false, 'profile', to_jsonb(p));
+                end if;
+                update profiles set
+                    daily_analyses = used + 1,
+                    total_analyses = coalesce(total_analyses, 0) + 1,
+                    last_analysis_date = current_date
+                where id = uid
+                returning * into p;
+                return jsonb_build_object('allowed', true, 'profile', to_jsonb(p));
+            end;
+            $$;
+
+        Until it is deployed, or when the profile does not exist yet, falls
+        back to can_perform_analysis followed by record_analysis.
+        """
+        if self._check_rpc_available and not (self._is_test_mode() or user_id == 'fallback-test-user'):
+            self._invalidate_profile(user_id)
+            try:
+                response = supabase_client().rpc("try_record_analysis", {
+                    "uid": user_id,
+                    "daily_limits": DAILY_LIMITS_BY_TIER
+                }).execute()
+                result = response.data
+                if result:
+                    profile = result["profile"]
+                    self._cache_profile(profile)
+                    usage_info = self._get_usage_info(profile)
+                    if result["allowed"]:
+                        logger.info(f"Analysis recorded for user {user_id}: {analysis_type}")
+                        return True, "Analysis allowed", usage_info
+                    reason = f"Daily limit of {usage_info['daily_analyses_limit']} analysis reached for Free plan."
+                    return False, reason, usage_info
+            except Exception as e:
+                if getattr(e, "code", None) == "PGRST202":  # PostgREST: function not found
+                    logger.warning("try_record_analysis function not deployed; checking and recording separately")
+                    self._check_rpc_available = False
+                else:
+                    logger.error(f"DB error checking and recording analysis for user {user_id}: {e}")
+        
+        can_analyze, reason, usage_info = self.can_perform_analysis(user_id)
+        if not can_analyze:
+            return can_analyze, reason, usage_info
+        return True, reason, self.record_analysis(user_id, analysis_type) or usage_info
+
+    @log_performance
+    def refund_analysis(self, user_id: str) -> Dict:
+        """
+        Gives back an analysis reserved by check_and_record when it then failed,
+        so an API or agent error doesn't use up the user's daily quota.
+
+        Runs server-side through this Postgres function; a reservation made
+        before midnight has already been reset, so only today's is returned:
+
+            create or replace function refund_analysis(uid uuid)
+            returns setof profiles language sql as $$
+                update profiles set
+                    daily_analyses = greatest(coalesce(daily_analyses, 0) - 1, 0),
+                    total_analyses = greatest(coalesce(total_analyses, 0) - 1, 0)
+                where id = uid and last_analysis_date = current_date
+                returning *;
+            $$;
+
+        Until it is deployed, the select-then-update path below is used.
+        """
+        if self._is_test_mode() or user_id == 'fallback-test-user':
+            return {}
+        
+        self._invalidate_profile(user_id)
+        if self._refund_rpc_available:
+            try:
+                response = supabase_client().rpc("refund_analysis", {"uid": user_id}).execute()
+                if response.data:
+                    logger.info(f"Refunded failed analysis for user {user_id}")
+                    self._cache_profile(response.data[0])
+                    return self._get_usage_info(response.data[0])
+                return {}
+            except Exception as e:
+                if getattr(e, "code", None) != "PGRST202":  # PostgREST: function not found
+                    logger.error(f"DB error refunding analysis for user {user_id}: {e}")
+                    return {}
+                logger.warning("refund_analysis function not deployed; using select-then-update")
+                self._refund_rpc_available = False
+        
+        profile = self._get_or_create_user_profile(user_id)
+        today_str = _today_iso()
+        if not profile or profile.get("last_analysis_date") != today_str:
+            return {}
+        
+        update_data = {
+            "daily_analyses": max(profile.get("daily_analyses", 0) - 1, 0),
+            "total_analyses": max(profile.get("total_analyses", 0) - 1, 0)
+        }
+        self._invalidate_profile(user_id)
+        try:
+            response = supabase_client().table("profiles").update(update_data).eq("id", user_id).execute()
+            if response.data:
+                logger.info(f"Refunded failed analysis for user {user_id}")
+                self._cache_profile(response.data[0])
+                return self._get_usage_info(response.data[0], today_str=today_str)
+            return {}
+        except Exception as e:
+            logger.error(f"DB error refunding analysis for user {user_id}: {e}")
+            return {}
+
+    def _get_usage_info(
+        self, profile: Dict, current_daily_count: Optional[int] = None, today_str: Optional[str] = None
+    ) -> Dict:
+        """Helper to construct the usage info dictionary.
+
+        Callers that already computed today's date pass it as ``today_str`` so the
+        daily-reset check doesn't format the date again.
+        """
+        tier = profile.get("subscription_tier", "free")
+        if tier not in UsageLimits.TIER_LIMITS_BY_STR:
+            tier = SubscriptionTier.FREE.value
+        limits = UsageLimits.TIER_LIMITS_BY_STR[tier]
         
         daily_used = current_daily_count if current_daily_count is not None else profile.get("daily_analyses", 0)
         
         # Reset daily count display if it's a new day
-        if profile.get("last_analysis_date") != datetime.now().date().isoformat():
+        if today_str is None:
+            today_str = _today_iso()
+        if profile.get("last_analysis_date") != today_str:
             daily_used = 0
 
         remaining = -1 # Unlimited
@@ -187,7 +443,7 @@ class DBUsageTracker:
             remaining = limits["daily_analyses"] - daily_used
 
         return {
-            'current_tier': tier.value,
+            'current_tier': tier,
             'daily_analyses_used': daily_used,
             'daily_analyses_limit': limits["daily_analyses"],
             'analyses_remaining': remaining,
@@ -203,10 +459,10 @@ class DBUsageTracker:
             return {
                 'current_tier': 'free',
                 'daily_analyses_used': 0,
-                'daily_analyses_limit': UsageLimits.TIER_LIMITS[SubscriptionTier.FREE]['daily_analyses'],
-                'analyses_remaining': UsageLimits.TIER_LIMITS[SubscriptionTier.FREE]['daily_analyses'],
+                'daily_analyses_limit': UsageLimits.DEFAULT['daily_analyses'],
+                'analyses_remaining': UsageLimits.DEFAULT['daily_analyses'],
                 'total_analyses': 0,
-                'max_file_size_mb': UsageLimits.TIER_LIMITS[SubscriptionTier.FREE]['max_file_size_mb'],
+                'max_file_size_mb': UsageLimits.DEFAULT['max_file_size_mb'],
             }
         return self._get_usage_info(profile)
 
@@ -222,18 +478,16 @@ class DBUsageTracker:
                 return False, "Unable to check user profile"
             
             # Get current tier
-            tier_str = profile.get("subscription_tier", "free")
-            try:
-                tier = SubscriptionTier(tier_str)
-            except ValueError:
-                tier = SubscriptionTier.FREE
+            tier = profile.get("subscription_tier", "free")
+            if tier not in UsageLimits.TIER_LIMITS_BY_STR:
+                tier = SubscriptionTier.FREE.value
             
             # Admin users never need upgrade prompts
-            if tier == SubscriptionTier.ADMIN:
+            if tier == SubscriptionTier.ADMIN.value:
                 return False, "Admin user"
             
             # Pro and Enterprise users don't need upgrade prompts if subscription is active
-            if tier in [SubscriptionTier.PRO, SubscriptionTier.ENTERPRISE]:
+            if tier in (SubscriptionTier.PRO.value, SubscriptionTier.ENTERPRISE.value):
                 subscription_status = profile.get("subscription_status", "inactive")
                 if subscription_status == "active":
                     return False, "Active subscription"
@@ -241,7 +495,7 @@ class DBUsageTracker:
                     return True, "Subscription expired or inactive"
             
             # Free users: check if they've hit their daily limit
-            if tier == SubscriptionTier.FREE:
+            if tier == SubscriptionTier.FREE.value:
                 can_analyze, reason, _ = self.can_perform_analysis(user_id)
                 if not can_analyze and "limit" in reason.lower():
                     return True, "Daily analysis limit reached"
@@ -256,6 +510,46 @@ class DBUsageTracker:
 
     # --- Webhook-related methods ---
 
+    def _apply_profile_patch(self, user_id: str, patch: Dict) -> Optional[Dict]:
+        """Writes a partial update to one profile and returns the updated row, if any."""
+        # Drop the cached copy up front so a failed write can't leave it stale
+        self._invalidate_profile(user_id)
+        response = supabase_client().table("profiles").update(patch).eq("id", user_id).execute()
+        if not response.data:
+            return None
+        self._cache_profile(response.data[0])
+        return response.data[0]
+
+    @log_performance
+    def apply_subscription_events(self, patches: List[Tuple[str, Dict]]) -> bool:
+        """
+        Applies a burst of (user_id, patch) profile updates in as few round-trips
+        as possible. Patches for the same user are merged in arrival order, and
+        users whose merged patches set the same columns share one upsert.
+        """
+        merged: Dict[str, Dict] = {}
+        for user_id, patch in patches:
+            merged.setdefault(user_id, {}).update(patch)
+
+        # PostgREST applies one column list per request, so batched rows must
+        # share their keys or the missing ones would be written as NULL
+        batches: Dict[Tuple[str, ...], List[Dict]] = {}
+        for user_id, patch in merged.items():
+            self._invalidate_profile(user_id)
+            batches.setdefault(tuple(sorted(patch)), []).append({"id": user_id, **patch})
+
+        try:
+            for rows in batches.values():
+                response = supabase_client().table("profiles").upsert(rows, on_conflict="id").execute()
+                for profile in response.data or []:
+                    self._cache_profile(profile)
+            logger.info(f"Applied {len(patches)} subscription updates to {len(merged)} users "
+                        f"in {len(batches)} requests")
+            return True
+        except Exception as e:
+            logger.error(f"DB error applying {len(patches)} subscription updates: {e}")
+            return False
+
     @log_performance
     def upgrade_user_subscription(self, user_id: str, tier: SubscriptionTier,
                                  stripe_customer_id: str, stripe_subscription_id: str) -> bool:
@@ -268,11 +562,10 @@ class DBUsageTracker:
             "subscription_expires_at": (datetime.now() + timedelta(days=31)).isoformat() # Grace period
         }
         try:
-            response = supabase_client.table("profiles").update(update_data).eq("id", user_id).execute()
-            if response.data:
+            if self._apply_profile_patch(user_id, update_data):
                 logger.info(f"Successfully upgraded user {user_id} to {tier.value}")
                 return True
-            logger.error(f"Failed to upgrade user {user_id} in DB: {response.error}")
+            logger.error(f"Failed to upgrade user {user_id} in DB")
             return False
         except Exception as e:
             logger.error(f"DB error upgrading user {user_id}: {e}")
@@ -288,11 +581,10 @@ class DBUsageTracker:
             "subscription_expires_at": None
         }
         try:
-            response = supabase_client.table("profiles").update(update_data).eq("id", user_id).execute()
-            if response.data:
+            if self._apply_profile_patch(user_id, update_data):
                 logger.info(f"Downgraded user {user_id} to free (reason: {reason})")
                 return True
-            logger.error(f"Failed to downgrade user {user_id} in DB: {response.error}")
+            logger.error(f"Failed to downgrade user {user_id} in DB")
             return False
         except Exception as e:
             logger.error(f"DB error downgrading user {user_id}: {e}")
@@ -302,9 +594,11 @@ class DBUsageTracker:
     def get_user_by_customer_id(self, customer_id: str) -> Optional[str]:
         """Finds a user ID by their Stripe Customer ID."""
         try:
-            response = supabase_client.table("profiles").select("id").eq("stripe_customer_id", customer_id).limit(1).execute()
-            if response.data:
-                return response.data[0]['id']
+            # limit(1) stays: customer ids aren't guaranteed unique, and
+            # maybe_single() errors on more than one row
+            response = supabase_client().table("profiles").select("id").eq("stripe_customer_id", customer_id).limit(1).maybe_single().execute()
+            if response and response.data:
+                return response.data['id']
             return None
         except Exception as e:
             logger.error(f"Error finding user by customer ID {customer_id}: {e}")
@@ -325,11 +619,10 @@ class DBUsageTracker:
             update_data["subscription_expires_at"] = (datetime.now() + timedelta(days=31)).isoformat()
 
         try:
-            response = supabase_client.table("profiles").update(update_data).eq("id", user_id).execute()
-            if response.data:
+            if self._apply_profile_patch(user_id, update_data):
                 logger.info(f"Updated subscription status for user {user_id} to '{status}'")
                 return True
-            logger.error(f"Failed to update status for user {user_id}: {response.error}")
+            logger.error(f"Failed to update status for user {user_id}")
             return False
         except Exception as e:
             logger.error(f"DB error updating status for user {user_id}: {e}")
@@ -343,11 +636,10 @@ class DBUsageTracker:
             "subscription_expires_at": (datetime.now() + timedelta(days=31)).isoformat()
         }
         try:
-            response = supabase_client.table("profiles").update(update_data).eq("id", user_id).execute()
-            if response.data:
+            if self._apply_profile_patch(user_id, update_data):
                 logger.info(f"Confirmed active subscription for user {user_id}")
                 return True
-            logger.error(f"Failed to confirm subscription for user {user_id}: {response.error}")
+            logger.error(f"Failed to confirm subscription for user {user_id}")
             return False
         except Exception as e:
             logger.error(f"DB error confirming subscription for user {user_id}: {e}")
@@ -362,11 +654,10 @@ class DBUsageTracker:
             "subscription_expires_at": None  # Admin never expires
         }
         try:
-            response = supabase_client.table("profiles").update(update_data).eq("id", user_id).execute()
-            if response.data:
+            if self._apply_profile_patch(user_id, update_data):
                 logger.info(f"Successfully upgraded user {user_id} to ADMIN tier")
                 return True
-            logger.error(f"Failed to upgrade user {user_id} to admin: {response.error}")
+            logger.error(f"Failed to upgrade user {user_id} to admin")
             return False
         except Exception as e:
             logger.error(f"DB error upgrading user {user_id} to admin: {e}")
@@ -377,15 +668,15 @@ class DBUsageTracker:
         """Finds a user ID by their email address."""
         try:
             # First try to get from profiles table if email is stored there
-            response = supabase_client.table("profiles").select("id, email").eq("email", email).execute()
-            if response.data:
-                return response.data[0]["id"]
+            response = supabase_client().table("profiles").select("id").eq("email", email).limit(1).maybe_single().execute()
+            if response and response.data:
+                return response.data["id"]
             
             # If not found in profiles, query auth.users through RPC or direct query
             # Note: This might require additional permissions or a custom RPC function
             try:
                 # Alternative: Use a stored procedure/function if available
-                rpc_response = supabase_client.rpc('get_user_id_by_email', {'user_email': email}).execute()
+                rpc_response = supabase_client().rpc('get_user_id_by_email', {'user_email': email}).execute()
                 if rpc_response.data:
                     return rpc_response.data
             except:
@@ -401,31 +692,86 @@ class DBUsageTracker:
     @log_performance
     def upgrade_user_by_email(self, email: str, tier: SubscriptionTier = SubscriptionTier.ADMIN) -> bool:
         """Upgrades a user to specified tier by email address."""
+        cache_key = (email, tier.value)
+        upgraded_at = _UPGRADE_CACHE.get(cache_key)
+        if upgraded_at is not None and time.monotonic() - upgraded_at < UPGRADE_CACHE_TTL:
+            return True
+        
+        update_data = self._tier_override_patch(tier)
+        
         try:
-            # Try to find existing profile by email
-            response = supabase_client.table("profiles").select("id").eq("email", email).execute()
-            
+            # Update by email directly instead of looking up the user id first
+            response = supabase_client().table("profiles").update(update_data).eq("email", email).execute()
             if response.data:
-                user_id = response.data[0]["id"]
-                logger.info(f"Found user {user_id} with email {email}")
-            else:
-                # If no profile found with email, try to create one
-                # This assumes the user exists in auth.users
-                logger.info(f"No profile found for {email}, will create one if user exists")
-                
-                # For now, we'll need the user to sign up first
-                logger.error(f"User with email {email} not found. Please ensure user has signed up first.")
-                return False
+                _UPGRADE_CACHE[cache_key] = time.monotonic()
+                for profile in response.data:
+                    self._cache_profile(profile)
+                logger.info(f"Successfully upgraded user {response.data[0]['id']} ({email}) to {tier.value}")
+                return True
             
-            # Upgrade the user
-            if tier == SubscriptionTier.ADMIN:
-                return self.upgrade_to_admin(user_id)
-            else:
-                return self.upgrade_user_subscription(user_id, tier, "admin_override", "admin_override")
+            # For now, we'll need the user to sign up first
+            logger.error(f"User with email {email} not found. Please ensure user has signed up first.")
+            return False
                 
         except Exception as e:
             logger.error(f"Error upgrading user by email {email}: {e}")
             return False
 
+    @log_performance
+    def upgrade_users_by_emails(self, emails: List[str], tier: SubscriptionTier = SubscriptionTier.ADMIN) -> List[str]:
+        """Upgrades every listed user to the given tier in one request; returns the emails that were upgraded."""
+        now = time.monotonic()
+        pending, upgraded = [], []
+        for email in dict.fromkeys(emails):
+            upgraded_at = _UPGRADE_CACHE.get((email, tier.value))
+            if upgraded_at is not None and now - upgraded_at < UPGRADE_CACHE_TTL:
+                upgraded.append(email)
+            else:
+                pending.append(email)
+        if not pending:
+            return upgraded
+
+        try:
+            response = (
+                supabase_client().table("profiles")
+                .update(self._tier_override_patch(tier))
+                .in_("email", pending)
+                .execute()
+            )
+        except Exception as e:
+            logger.error(f"Error upgrading {len(pending)} users by email: {e}")
+            return upgraded
+
+        now = time.monotonic()
+        for profile in response.data or []:
+            self._cache_profile(profile)
+            email = profile.get("email")
+            if email:
+                _UPGRADE_CACHE[(email, tier.value)] = now
+                upgraded.append(email)
+
+        missing = set(pending).difference(upgraded)
+        if missing:
+            logger.error(f"Users not found for {len(missing)} emails. Please ensure they have signed up first.")
+        logger.info(f"Upgraded {len(upgraded)} of {len(emails)} users to {tier.value}")
+        return upgraded
+
+    @staticmethod
+    def _tier_override_patch(tier: SubscriptionTier) -> Dict:
+        """Builds the profile update for a manual (non-Stripe) tier change."""
+        if tier == SubscriptionTier.ADMIN:
+            return {
+                "subscription_tier": SubscriptionTier.ADMIN.value,
+                "subscription_status": "active",
+                "subscription_expires_at": None  # Admin never expires
+            }
+        return {
+            "subscription_tier": tier.value,
+            "subscription_status": "active",
+            "stripe_customer_id": "admin_override",
+            "stripe_subscription_id": "admin_override",
+            "subscription_expires_at": (datetime.now() + timedelta(days=31)).isoformat() # Grace period
+        }
+
 # Global instance for the application to use
 db_usage_tracker = DBUsageTracker()
\ No newline at end of file
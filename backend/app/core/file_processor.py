@@ -3,17 +3,91 @@ Universal File Processor for Multimodal Insight Engine
 Handles CSV, PDF, TXT, and Image files for AI analysis
 """
 
-import os
 import base64
+import hashlib
+import multiprocessing
+import os
 import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
-from typing import Union, Tuple, Dict, Any
-import PyPDF2
-import pdfplumber
+from typing import Union, Tuple, Dict, Any, BinaryIO, Optional
+import pypdfium2 as pdfium
 from PIL import Image
 import streamlit as st
+import numpy as np
 import pandas as pd
 
+# Read size when hashing uploads that don't expose their buffer
+HASH_CHUNK_SIZE = 1 << 16
+
+# Rows parsed per chunk when streaming a CSV upload
+CSV_CHUNK_ROWS = 100_000
+
+# Above this many rows, the CSV summary estimates quartiles from a sample of this size
+SUMMARY_SAMPLE_ROWS = 100_000
+
+# Images larger than this on either side are downscaled and sent as JPEG, since
+# the model gains little from more pixels and the base64 payload grows with them
+IMAGE_MAX_DIMENSION = 1024
+IMAGE_JPEG_QUALITY = 85
+
+# Processed results kept for re-uploads of identical files
+PROCESSED_CACHE_SIZE = 16
+
+# PDFs with at least this many pages have their text extracted across worker
+# processes; below it, pool startup costs more than PDFium's ~1ms a page
+PDF_PARALLEL_MIN_PAGES = 200
+PDF_MAX_WORKERS = 4
+
+# One pool serves every PDF for the life of the process. Workers are spawned,
+# not forked: forking Streamlit's multithreaded server can copy a held lock
+# into the child and deadlock it.
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _page_text(pdf: Any, index: int) -> str:
+    """Text layer of one page, with PDFium's CRLF line breaks normalised"""
+    page = pdf[index]
+    textpage = page.get_textpage()
+    text = textpage.get_text_range()
+    textpage.close()
+    page.close()
+    return text.replace('\r\n', '\n')
+
+
+def _extract_page_range(task: Tuple[str, int, int]) -> list:
+    """Runs in a pool worker: open the PDF at path and extract pages [start, stop)"""
+    path, start, stop = task
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return [_page_text(pdf, index) for index in range(start, stop)]
+    finally:
+        pdf.close()
+
+
+def _get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    """Shared spawn-context pool for PDF extraction, started on first use"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next PDF starts a fresh one"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False)
+
+
 class UniversalFileProcessor:
     """
     Handles processing of multiple file types for AI analysis
@@ -25,6 +99,8 @@ class UniversalFileProcessor:
         'text': ['txt', 'text'],
         'image': ['jpg', 'jpeg', 'png', 'webp', 'gif', 'bmp']
     }
+    # Reverse index so get_file_type is a single lookup
+    _EXT_TO_TYPE = {ext: file_type for file_type, exts in SUPPORTED_EXTENSIONS.items() for ext in exts}
     
     MAX_FILE_SIZES = {
         'csv': 100 * 1024 * 1024,
@@ -34,7 +110,9 @@ class UniversalFileProcessor:
     }
     
     def __init__(self):
-        pass
+        # (file type, content hash) -> processed result, least recently used first
+        self._results: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._results_lock = threading.Lock()
 
     def _get_file_bytes(self, uploaded_file: Any) -> bytes:
         """Safely get bytes from a file-like object provided by Streamlit."""
@@ -61,11 +139,7 @@ class UniversalFileProcessor:
         """Determine file type from extension"""
         if not filename:
             return 'unknown'
-        ext = filename.lower().split('.')[-1]
-        for file_type, extensions in self.SUPPORTED_EXTENSIONS.items():
-            if ext in extensions:
-                return file_type
-        return 'unknown'
+        return self._EXT_TO_TYPE.get(filename.rsplit('.', 1)[-1].lower(), 'unknown')
     
     def validate_file(self, uploaded_file, file_type: str) -> Tuple[bool, str]:
         """Validate file size and type"""
@@ -86,47 +160,133 @@ class UniversalFileProcessor:
         
         return True, "File validation successful"
     
-    def process_csv(self, file_bytes: bytes) -> Dict[str, Any]:
-        """Process CSV file and return data info"""
+    def compute_hash(self, uploaded_file: Any) -> str:
+        """
+        BLAKE2b hash of an upload (or its bytes) without copying it into a new bytes object.
+        Same digest as AnalysisHistoryManager._calculate_file_hash on the raw bytes.
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        if isinstance(uploaded_file, (bytes, bytearray, memoryview)):
+            digest.update(uploaded_file)
+        elif hasattr(uploaded_file, 'getbuffer'):
+            # BytesIO-backed uploads (Streamlit's UploadedFile) expose their buffer directly
+            with uploaded_file.getbuffer() as view:
+                digest.update(view)
+        else:
+            uploaded_file.seek(0)
+            for chunk in iter(lambda: uploaded_file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+            uploaded_file.seek(0)
+        return digest.hexdigest()
+
+    def process_csv(self, file_source: Union[bytes, BinaryIO]) -> Dict[str, Any]:
+        """Process CSV file (raw bytes or a seekable binary file) and return data info"""
+        if isinstance(file_source, (bytes, bytearray)):
+            file_source = BytesIO(file_source)
+        
+        rows = 0
+        head_parts = []
+        dtypes: Dict[str, Any] = {}
+        gappy = set()
+        numeric_parts: Dict[str, list] = {}
         try:
-            file_data = BytesIO(file_bytes)
-            df = pd.read_csv(file_data)
+            file_source.seek(0)
+            # Stream fixed-size chunks so peak memory follows the chunk, not the
+            # file; only numeric columns (8 bytes a cell) are kept for describe()
+            for chunk in pd.read_csv(file_source, chunksize=CSV_CHUNK_ROWS):
+                if rows < 5:
+                    head_parts.append(chunk.head(5 - rows))
+                rows += len(chunk)
+                has_values = chunk.notna().any()
+                for col, dtype in chunk.dtypes.items():
+                    if not has_values[col]:
+                        # An all-empty chunk parses as float64; it only means the column has gaps
+                        gappy.add(col)
+                        dtypes.setdefault(col, None)
+                    elif dtypes.get(col) is None:
+                        dtypes[col] = dtype
+                    else:
+                        dtypes[col] = self._merge_chunk_dtype(dtypes[col], dtype)
+                    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                        numeric_parts.setdefault(col, []).append(chunk[col])
         except pd.errors.EmptyDataError:
             raise ValueError("The CSV file is empty.")
         except Exception as e:
             raise ValueError(f"Error reading CSV file: {e}")
+        
+        for col in gappy:
+            # Missing values widen ints to float and bools to object, as in a whole-file read
+            dtype = dtypes[col]
+            if dtype is None:
+                # Never filled: float64 like any empty column, or object in a header-only file
+                dtypes[col] = np.dtype('float64') if rows else np.dtype(object)
+            elif pd.api.types.is_integer_dtype(dtype):
+                dtypes[col] = np.dtype('float64')
+            elif pd.api.types.is_bool_dtype(dtype):
+                dtypes[col] = np.dtype(object)
+        
+        # Cast before concatenating so e.g. bools aren't coerced to ints along the way
+        head = pd.concat([part.astype(dtypes) for part in head_parts])
+        column_names = head.columns.tolist()
+        numeric_df = pd.DataFrame({
+            col: pd.concat(numeric_parts[col], ignore_index=True)
+            for col in column_names
+            if col in numeric_parts and pd.api.types.is_numeric_dtype(dtypes[col])
+        })
             
         metadata = {
-            'rows': len(df),
-            'columns': len(df.columns),
-            'column_names': df.columns.tolist(),
+            'rows': rows,
+            'columns': len(column_names),
+            'column_names': column_names,
         }
+        text_summary = self._csv_text_summary(rows, dtypes, numeric_df, head)
         
         return {
             'type': 'csv',
-            'content': self._df_to_text_summary(df),  # Add content field for consistency
-            'dataframe': df, # The agent needs this
+            'content': text_summary,  # Add content field for consistency
             'metadata': metadata,
-            'text_summary': self._df_to_text_summary(df)
+            'text_summary': text_summary
         }
 
+    @staticmethod
+    def _merge_chunk_dtype(current: Any, new: Any) -> Any:
+        """The dtype pandas gives a column whose chunks parsed as `current` and `new`"""
+        if current == new:
+            return current
+        if all(pd.api.types.is_numeric_dtype(d) and not pd.api.types.is_bool_dtype(d) for d in (current, new)):
+            return np.result_type(current, new)
+        # A text chunk makes the whole column text, as one read would have parsed it
+        text = [d for d in (current, new) if pd.api.types.is_string_dtype(d)]
+        if len(text) == 1:
+            return text[0]
+        return np.dtype(object)
+
     def process_pdf(self, file_bytes: bytes) -> Dict[str, Any]:
         """Extract text from PDF file"""
         if not file_bytes.startswith(b'%PDF'):
             raise ValueError("File does not appear to be a valid PDF.")
         
-        extracted_text = ""
         metadata = {'pages': 0}
         
         try:
-            with pdfplumber.open(BytesIO(file_bytes)) as pdf:
-                metadata['pages'] = len(pdf.pages)
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        extracted_text += page_text + "\n\n"
+            # PDFium only needs the text layer, which is far cheaper than pdfminer's layout pass
+            pdf = pdfium.PdfDocument(file_bytes)
+            try:
+                page_count = len(pdf)
+                metadata['pages'] = page_count
+                page_texts = None
+                workers = min(os.cpu_count() or 1, PDF_MAX_WORKERS)
+                if page_count >= PDF_PARALLEL_MIN_PAGES and workers > 1:
+                    page_texts = self._extract_pages_parallel(file_bytes, page_count, workers)
+                if page_texts is None:
+                    page_texts = [_page_text(pdf, index) for index in range(page_count)]
+            finally:
+                pdf.close()
         except Exception as e:
             raise IOError(f"Could not process PDF file. It might be corrupted or password-protected. Error: {e}")
+        
+        # One join instead of repeated += keeps this linear in the text length
+        extracted_text = "".join(f"{page_text}\n\n" for page_text in page_texts if page_text)
 
         metadata['word_count'] = len(extracted_text.split())
         
@@ -136,6 +296,32 @@ class UniversalFileProcessor:
             'metadata': metadata
         }
 
+    def _extract_pages_parallel(self, file_bytes: bytes, page_count: int, workers: int) -> Optional[list]:
+        """
+        Page texts in order, extracted by the shared process pool (PDFium isn't thread-safe).
+        Returns None if the pool can't run, so the caller extracts sequentially.
+        """
+        # A few ranges per worker evens out pages of uneven weight
+        step = -(-page_count // (workers * 4))
+        pool = None
+        path = None
+        try:
+            # Workers read the PDF from disk, so only a path crosses the process boundary
+            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+                f.write(file_bytes)
+                path = f.name
+            tasks = [(path, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            pool = _get_pdf_pool(workers)
+            return [text for chunk in pool.map(_extract_page_range, tasks) for text in chunk]
+        except BrokenProcessPool:
+            _discard_pdf_pool(pool)
+            return None
+        except OSError:
+            return None
+        finally:
+            if path is not None:
+                os.unlink(path)
+
     def process_txt(self, file_bytes: bytes) -> Dict[str, Any]:
         """Process text file"""
         encodings_to_try = ['utf-8', 'latin-1', 'cp1252']
@@ -156,22 +342,60 @@ class UniversalFileProcessor:
             'metadata': {'word_count': len(text_content.split())}
         }
 
+    def process_image_metadata(self, file_bytes: bytes) -> Dict[str, Any]:
+        """Read image dimensions and format from the header, without decoding pixels or encoding base64"""
+        try:
+            # Image.open only parses the header; pixel data is never loaded here
+            with Image.open(BytesIO(file_bytes)) as image:
+                width, height = image.size
+                format_name = image.format or 'unknown'
+        except Exception as e:
+            raise IOError(f"Cannot process image file. It might be corrupted or in an unsupported format. Error: {e}")
+        
+        return {'width': width, 'height': height, 'format': format_name}
+    
     def process_image(self, file_bytes: bytes) -> Dict[str, Any]:
         """Process image file and convert to base64"""
+        metadata = self.process_image_metadata(file_bytes)
+        if max(metadata['width'], metadata['height']) > IMAGE_MAX_DIMENSION:
+            file_bytes = self._downscale_image(file_bytes, metadata)
+        
+        return {
+            'content': base64.b64encode(file_bytes).decode('ascii'),
+            'type': 'image',
+            'metadata': metadata
+        }
+    
+    def _downscale_image(self, file_bytes: bytes, metadata: Dict[str, Any]) -> bytes:
+        """Re-encode an oversized image as a JPEG within IMAGE_MAX_DIMENSION, updating metadata in place"""
         try:
-            image = Image.open(BytesIO(file_bytes))
-            width, height = image.size
-            format_name = image.format or 'unknown'
-            
-            base64_image = base64.b64encode(file_bytes).decode('utf-8')
-            
-            return {
-                'content': base64_image,
-                'type': 'image',
-                'metadata': {'width': width, 'height': height, 'format': format_name}
-            }
+            with Image.open(BytesIO(file_bytes)) as image:
+                if image.mode == 'P':
+                    # Palette images would otherwise be resized with nearest-neighbour
+                    image = image.convert('RGBA')
+                # thumbnail() keeps the aspect ratio and lets JPEGs decode at a reduced scale
+                image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.Resampling.LANCZOS)
+                if image.mode in ('RGBA', 'LA'):
+                    # JPEG has no alpha channel, so flatten onto white
+                    flattened = Image.new('RGB', image.size, (255, 255, 255))
+                    flattened.paste(image, mask=image.getchannel('A'))
+                    image = flattened
+                elif image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                buffer = BytesIO()
+                image.save(buffer, format='JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
         except Exception as e:
-            raise IOError(f"Cannot process image file. It might be corrupted or in an unsupported format. Error: {e}")
+            raise IOError(f"Cannot resize image file. It might be corrupted or in an unsupported format. Error: {e}")
+        
+        metadata.update({
+            'original_width': metadata['width'],
+            'original_height': metadata['height'],
+            'width': image.width,
+            'height': image.height,
+            'format': 'JPEG',
+            'resized': True,
+        })
+        return buffer.getvalue()
     
     def process_file(self, uploaded_file: Any) -> Dict[str, Any]:
         """Main processing function that routes to appropriate handler"""
@@ -181,6 +405,28 @@ class UniversalFileProcessor:
         if not is_valid:
             raise ValueError(validation_message)
         
+        try:
+            content_hash = self.compute_hash(uploaded_file)
+        except Exception as e:
+            raise IOError(f"Could not read file content: {e}")
+        
+        # Re-uploads of the same file skip processing entirely
+        cache_key = (file_type, content_hash)
+        with self._results_lock:
+            cached = self._results.get(cache_key)
+            if cached is not None:
+                self._results.move_to_end(cache_key)
+                return dict(cached)
+        
+        if file_type == 'csv' and hasattr(uploaded_file, 'seek'):
+            # Parse straight from the upload; a bytes copy of a large CSV would
+            # double peak memory
+            try:
+                processed_data = self.process_csv(uploaded_file)
+            except Exception as e:
+                raise RuntimeError(f"Failed to process {file_type} file: {e}")
+            return self._remember_result(cache_key, processed_data)
+        
         try:
             file_bytes = self._get_file_bytes(uploaded_file)
         except Exception as e:
@@ -200,30 +446,57 @@ class UniversalFileProcessor:
             
         try:
             processed_data = process_function(file_bytes)
-            processed_data['raw_content'] = file_bytes # Add raw bytes for hashing
-            return processed_data
         except Exception as e:
             raise RuntimeError(f"Failed to process {file_type} file: {e}")
+        return self._remember_result(cache_key, processed_data)
+
+    def _remember_result(self, cache_key: Tuple[str, str], processed_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Stamp the content hash on a fresh result and keep it for repeat uploads"""
+        # Keep only the digest; holding the bytes would pin the whole upload
+        # in session state for the life of the analysis
+        processed_data['content_hash'] = cache_key[1]
+        with self._results_lock:
+            self._results[cache_key] = processed_data
+            while len(self._results) > PROCESSED_CACHE_SIZE:
+                self._results.popitem(last=False)
+        # Callers get their own top-level dict so they can't alter the cached entry
+        return dict(processed_data)
 
     def _df_to_text_summary(self, df: pd.DataFrame) -> str:
         """Convert DataFrame to text summary for AI analysis"""
+        numeric_cols = df.select_dtypes(include=['number']).columns
+        return self._csv_text_summary(len(df), dict(df.dtypes), df[numeric_cols], df.head())
+
+    def _csv_text_summary(self, rows: int, dtypes: Dict[str, Any], numeric_df: pd.DataFrame,
+                          head: pd.DataFrame) -> str:
+        """Build the AI-facing summary from streamed CSV aggregates"""
         summary = f"Dataset Overview:\n"
-        summary += f"- Shape: {df.shape[0]} rows, {df.shape[1]} columns\n"
-        summary += f"- Columns: {', '.join(df.columns.tolist())}\n\n"
+        summary += f"- Shape: {rows} rows, {len(dtypes)} columns\n"
+        summary += f"- Columns: {', '.join(map(str, dtypes))}\n\n"
         
         summary += "Column Data Types:\n"
-        for col, dtype in df.dtypes.items():
+        for col, dtype in dtypes.items():
             summary += f"- {col}: {dtype}\n"
         
-        numeric_cols = df.select_dtypes(include=['number']).columns
-        if len(numeric_cols) > 0:
+        if len(numeric_df.columns) > 0:
             summary += f"\nNumeric Columns Summary:\n"
-            summary += df[numeric_cols].describe().to_string()
+            summary += self._describe_numeric(numeric_df).to_string()
         
         summary += f"\n\nFirst 5 rows:\n"
-        summary += df.head().to_string()
+        summary += head.to_string()
         
         return summary
 
+    def _describe_numeric(self, numeric_df: pd.DataFrame) -> pd.DataFrame:
+        """describe() for numeric columns; on tall frames the quartiles come from a row sample"""
+        if len(numeric_df) <= SUMMARY_SAMPLE_ROWS:
+            return numeric_df.describe()
+        
+        # Exact single-pass reductions, with only the quartiles estimated
+        stats = numeric_df.agg(['count', 'mean', 'std', 'min', 'max'])
+        quartiles = numeric_df.sample(n=SUMMARY_SAMPLE_ROWS, random_state=0).quantile([0.25, 0.5, 0.75])
+        quartiles.index = [f"~{q:.0%}" for q in quartiles.index]
+        return pd.concat([stats.loc[['count', 'mean', 'std', 'min']], quartiles, stats.loc[['max']]])
+
 # Singleton instance
 file_processor = UniversalFileProcessor()
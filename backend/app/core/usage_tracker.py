@@ -15,6 +15,9 @@ class SubscriptionTier(Enum):
     ENTERPRISE = "enterprise"
     ADMIN = "admin"
 
+# Stored tier string -> enum member, bound once instead of an Enum value lookup per call
+_TIER_FROM_STR = {tier.value: tier for tier in SubscriptionTier}
+
 @dataclass
 class UsageStats:
     """User usage statistics."""
@@ -135,7 +138,7 @@ class UsageTracker:
             stats.daily_analyses = 0
         
         # Get user's tier limits
-        tier = SubscriptionTier(stats.subscription_tier)
+        tier = _TIER_FROM_STR.get(stats.subscription_tier, SubscriptionTier.FREE)
         limits = self.TIER_LIMITS[tier]
         
         # Check subscription expiry for paid tiers
@@ -194,7 +197,7 @@ class UsageTracker:
         logger.info(f"Analysis recorded for user {user_id}: {analysis_type}")
         
         # Return updated usage info
-        tier = SubscriptionTier(stats.subscription_tier)
+        tier = _TIER_FROM_STR.get(stats.subscription_tier, SubscriptionTier.FREE)
         limits = self.TIER_LIMITS[tier]
         remaining = limits.daily_analyses - stats.daily_analyses if limits.daily_analyses > 0 else -1
         
@@ -229,7 +232,7 @@ class UsageTracker:
     def get_user_tier_info(self, user_id: str) -> Dict:
         """Get comprehensive user tier and usage information."""
         stats = self._load_user_stats(user_id)
-        tier = SubscriptionTier(stats.subscription_tier)
+        tier = _TIER_FROM_STR.get(stats.subscription_tier, SubscriptionTier.FREE)
         limits = self.TIER_LIMITS[tier]
         
         today = datetime.now().date().isoformat()
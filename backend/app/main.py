@@ -15,9 +15,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 # Import safe components first (non-blocking)
 from app.core.file_processor import file_processor
-from app.auth.supabase_client import supabase_client
 from app.core.db_usage_tracker import db_usage_tracker as usage_tracker, SubscriptionTier
-from app.auth.authentication import display_auth_form, handle_logout
+from app.auth.authentication import display_auth_form, handle_logout, get_session_user
 from app.services.stripe_service import create_checkout_session
 from app.core.analysis_history import analysis_history, ExportFormat
 from app.services.export_service import report_exporter
@@ -33,7 +32,7 @@ if 'ui_initialized' not in st.session_state:
     st.session_state.ai_load_time = None
 
 # Guaranteed safe imports - NEVER import anthropic or AI models here
-# DO NOT import: from app.agents.universal_agent import universal_agent
+# DO NOT import: from app.agents.universal_agent import get_universal_agent
 
 @st.cache_resource(show_spinner="🤖 Initializing AI Agent for the first time...")
 def load_agent():
@@ -43,7 +42,8 @@ def load_agent():
     """
     # Ensure environment variables are loaded
     load_dotenv()
-    from app.agents.universal_agent import universal_agent
+    from app.agents.universal_agent import get_universal_agent
+    universal_agent = get_universal_agent()
     
     # Verify the agent is working before returning
     if not hasattr(universal_agent, 'claude_model') or universal_agent.claude_model is None:
@@ -260,12 +260,11 @@ def get_user_id():
     
     # If no user in session, try to get session silently (don't show errors)
     try:
-        if supabase_client:
-            session = supabase_client.auth.get_session()
-            if session and session.user:
-                st.session_state['user'] = session.user
-                st.session_state['authenticated'] = True  # Mark as authenticated
-                return session.user.id
+        session_user = get_session_user()
+        if session_user:
+            st.session_state['user'] = session_user
+            st.session_state['authenticated'] = True  # Mark as authenticated
+            return session_user.id
     except Exception:
         # Silent failure - let the authentication form handle it
         pass
@@ -920,6 +919,15 @@ def main():
                     st.error("Please upgrade to continue analyzing data.")
                     st.stop()
                 
+                # Reserve this analysis atomically; another session may have used
+                # the last one since the check above
+                can_analyze, reason, usage_stats = usage_tracker.check_and_record(
+                    user_id, st.session_state.file_type
+                )
+                if not can_analyze:
+                    st.warning(f"🚫 **Analysis Limit Reached**: {reason}")
+                    st.stop()
+                
                 st.session_state.messages.append({"role": "user", "content": prompt})
                 with st.chat_message("user"):
                     st.markdown(prompt)
@@ -934,6 +942,8 @@ def main():
                     status_container = main_container.container()
                     results_container = st.container()
                     
+                    analysis_succeeded = False
+                    refunded = False
                     try:
                         # Show analysis type
                         file_type = st.session_state.file_type
@@ -957,26 +967,32 @@ def main():
                             response = "Error: AI Agent failed to initialize. Please check your API key and environment settings."
                             status_container.error("AI Agent could not be loaded.")
                         else:
-                            # Agent is ready - proceed with analysis
+                            # Agent is ready - stream the answer as Claude writes it
+                            stream_placeholder = results_container.empty()
                             try:
-                                response = agent.analyze_content(st.session_state.processed_content, prompt)
+                                with stream_placeholder.container():
+                                    response = st.write_stream(
+                                        agent.analyze_content_stream(st.session_state.processed_content, prompt)
+                                    )
                             except Exception as e:
                                 response = f"Error: Analysis failed - {str(e)}"
                                 status_container.error(f"⚠️ Analysis error: {str(e)}")
+                            # The formatted result or error replaces the streamed text below
+                            stream_placeholder.empty()
                         
                         execution_time = time.time() - start_time
                         
                         if response and not response.startswith("Error"):
+                            analysis_succeeded = True
                             # Clear progress display
                             main_container.empty()
                             
-                            # Record successful analysis
-                            usage_stats = usage_tracker.record_analysis(user_id, file_type)
-                            
                             # Save analysis to history
-                            # Ensure we have valid file content for hashing
-                            file_content_for_hash = st.session_state.processed_content.get('raw_content')
-                            if file_content_for_hash is None:
+                            # The processor hashes the upload; the filename only stands in
+                            # for content processed before that hash existed
+                            file_hash = st.session_state.processed_content.get('content_hash')
+                            file_content_for_hash = None
+                            if file_hash is None:
                                 # Fallback: use the filename as a simple identifier
                                 file_content_for_hash = st.session_state.uploaded_file_name.encode('utf-8')
                             
@@ -987,7 +1003,8 @@ def main():
                                 response=response,
                                 file_content=file_content_for_hash,
                                 execution_time=execution_time,
-                                subscription_tier=usage_stats.get('current_tier', 'free')
+                                subscription_tier=usage_stats.get('current_tier', 'free'),
+                                file_hash=file_hash
                             )
                             
                             # Display results with file-type specific formatting
@@ -1014,6 +1031,9 @@ def main():
                             if remaining >= 0 and remaining <= 1:
                                 results_container.info(f"ℹ️ You have {remaining} analysis remaining today")
                         else:
+                            # The analysis was reserved up front; give it back
+                            usage_tracker.refund_analysis(user_id)
+                            refunded = True
                             # Clear progress and show error
                             main_container.empty()
                             error_msg = response if response else "Analysis failed"
@@ -1022,6 +1042,8 @@ def main():
                         
                     except Exception as e:
                         # Fallback for any unexpected errors
+                        if not analysis_succeeded and not refunded:
+                            usage_tracker.refund_analysis(user_id)
                         main_container.empty()
                         error_message = f"⚠️ **Unexpected Error:** {e}\n\nPlease try again or contact support if the issue persists."
                         results_container.error(error_message)
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+from app.core.cache_manager import cache_manager
+from app.core.data_processor import DataProcessor
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    """DataProcessor backed by a throwaway local file cache."""
+    monkeypatch.setattr(cache_manager, "use_redis", False)
+    monkeypatch.setattr(cache_manager, "_backend_ready", True)
+    monkeypatch.setattr(cache_manager, "cache_dir", str(tmp_path))
+    return DataProcessor()
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        "a": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        "b": [2.0, 4.1, 6.2, 7.9, 10.1, 12.0],
+        "c": [5.0, 3.0, 4.0, 1.0, 2.0, 6.0],
+        "label": ["x", "y", "x", "z", "y", "x"],
+    })
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError("expected the result to come from the cache")
+
+
+def test_analyze_data_quality_second_call_is_cached(processor, df, monkeypatch):
+    first = processor.analyze_data_quality(df)
+
+    monkeypatch.setattr(DataProcessor, "_analyze_missing_data", _fail)
+    monkeypatch.setattr(DataProcessor, "_generate_statistics", _fail)
+    second = processor.analyze_data_quality(df)
+
+    assert set(second) == set(first)
+    assert second["dataset_info"] == first["dataset_info"]
+    assert second["missing_data"] == first["missing_data"]
+
+
+def test_detect_correlations_second_call_is_cached(processor, df, monkeypatch):
+    first = processor.detect_correlations(df, threshold=0.7)
+
+    monkeypatch.setattr(DataProcessor, "_correlation_matrix", _fail)
+    second = processor.detect_correlations(df, threshold=0.7)
+
+    assert second == first